@@ -0,0 +1,160 @@
+# Async database access for the async endpoints
+# Wraps the blocking mysql.connector calls of db.py in a bounded thread pool,
+# so a DB round trip never stalls the event loop.
+# RequestConnectionMiddleware gives every request one shared connection (db.UnitOfWork).
+
+import os
+import asyncio
+import contextvars
+import anyio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from db import get_connection, fetch_schema, execute_query, fetch_rows, QueryStream, begin_unit, end_unit
+
+
+load_dotenv(override=True)
+
+# Keep it at (or below) the pool size, more threads would only queue on the pool
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "10"))
+
+executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+# Connections are given back on threads of their own. Queued behind DB calls blocked in the pool's acquire
+# (waiting for the very connections being given back), releases would stall everything until DB_POOL_TIMEOUT.
+DB_CLEANUP_WORKERS = int(os.getenv("DB_CLEANUP_WORKERS", "2"))
+
+cleanup_executor = ThreadPoolExecutor(max_workers=DB_CLEANUP_WORKERS, thread_name_prefix="db-cleanup")
+
+
+async def run_db(func, *args, **kwargs):
+
+    """
+    Runs a blocking DB function in the DB thread pool and awaits its result.
+    The caller's context variables are carried over to the worker thread.
+    """
+
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+
+    return await loop.run_in_executor(executor, partial(ctx.run, func, *args, **kwargs))
+
+
+async def run_db_cleanup(func, *args, **kwargs):
+
+    """
+    Runs a blocking function that gives a connection back (never one that checks one out) on the cleanup threads.
+    It runs to the end even when the caller is being cancelled (client disconnected mid-stream),
+    otherwise the connection would only come back through the leak path.
+    """
+
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+
+    with anyio.CancelScope(shield=True):
+        return await loop.run_in_executor(cleanup_executor, partial(ctx.run, func, *args, **kwargs))
+
+
+async def get_connection_async():
+
+    """
+    Gets the connection with the database without blocking the event loop
+    """
+    return await run_db(get_connection)
+
+
+async def fetch_schema_async() -> str:
+
+    """
+    Fetches the whole database as schema without blocking the event loop
+    """
+    return await run_db(fetch_schema)
+
+
+async def execute_query_async(sql : str, params = None, dictionary : bool = False):
+
+    """
+    Executes the sql query and fetch result from Database without blocking the event loop
+    """
+    return await run_db(execute_query, sql, params, dictionary)
+
+
+async def fetch_rows_async(sql : str, params = None, dictionary : bool = False):
+
+    """
+    Executes the sql query and fetch all rows without blocking the event loop, raising on errors
+    """
+    return await run_db(fetch_rows, sql, params, dictionary)
+
+
+async def open_stream_async(sql : str, params = None, dictionary : bool = False, batch_size : int = None) -> QueryStream:
+
+    """
+    Starts a streaming query without blocking the event loop, the column names are known once it returns
+    """
+
+    stream = QueryStream(sql, params, dictionary, batch_size)
+    await run_db(stream.open)
+
+    return stream
+
+
+async def stream_batches_async(stream : QueryStream):
+
+    """
+    Async generator over the batches of an open QueryStream, each fetchmany runs in the DB thread pool.
+    The connection is released when the consumer stops (also early).
+    """
+
+    try:
+        while True:
+            rows = await run_db(stream.fetch_batch)
+            if not rows:
+                return
+            yield rows
+
+    finally:
+        await run_db_cleanup(stream.close)
+
+
+async def stream_query_async(sql : str, params = None, dictionary : bool = False, batch_size : int = None):
+
+    """
+    Async generator over a query result, batch by batch with constant memory.
+
+    async for rows in stream_query_async("SELECT * FROM leads"):
+        ...
+    """
+
+    stream = await open_stream_async(sql, params, dictionary, batch_size)
+
+    async for rows in stream_batches_async(stream):
+        yield rows
+
+
+class RequestConnectionMiddleware:
+
+    """
+    Runs every HTTP request in a unit of work: its DB calls share one connection, checked out on first use
+    and given back when the response is completely sent (streamed bodies included), also on errors.
+    Plain ASGI on purpose, BaseHTTPMiddleware runs the endpoint in another task that wouldn't see the unit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        unit, token = begin_unit()
+
+        try:
+            await self.app(scope, receive, send)
+
+        finally:
+            end_unit(token)
+            if unit.conn is not None:
+                await run_db_cleanup(unit.release)
@@ -0,0 +1,82 @@
+# Benchmark: concurrent request throughput with blocking vs async DB access
+#
+# Simulates N concurrent /chat requests inside one event loop, each doing a few DB round trips,
+# once calling db.py directly (what chat_endpoint used to do) and once through async_db.
+# Needs the same .env (DB_HOST, DB_USER, ...) as the app.
+#
+# Usage: python benchmarks/bench_async_db.py --requests 50 --calls 3 --sql "SELECT SLEEP(0.05)"
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import execute_query
+from async_db import execute_query_async
+
+
+async def loop_lag_probe(stop: asyncio.Event, samples: list):
+
+    """
+    Measures how late the event loop wakes up a 10ms sleeper (0 on a free loop)
+    """
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - start - 0.01)
+
+
+async def blocking_request(sql: str, calls: int):
+
+    for _ in range(calls):
+        execute_query(sql)
+
+
+async def async_request(sql: str, calls: int):
+
+    for _ in range(calls):
+        await execute_query_async(sql)
+
+
+async def run(request_fn, requests: int, calls: int, sql: str) -> dict:
+
+    stop = asyncio.Event()
+    lag = []
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request_fn(sql, calls) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await probe
+
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 2),
+        "max_loop_lag_ms": round(max(lag, default=0) * 1000, 1)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Blocking vs async DB throughput")
+    parser.add_argument("--requests", type=int, default=50, help="concurrent requests")
+    parser.add_argument("--calls", type=int, default=3, help="DB round trips per request")
+    parser.add_argument("--sql", default="SELECT SLEEP(0.05)", help="query run on every round trip")
+    args = parser.parse_args()
+
+    # Warm the pool so both runs start from the same state
+    execute_query("SELECT 1")
+
+    for name, fn in [("blocking (before)", blocking_request), ("async_db (after)", async_request)]:
+        result = asyncio.run(run(fn, args.requests, args.calls, args.sql))
+        print(f"{name:<18} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Benchmark: peak RSS and time of Excel report generation
+#
+# Compares the old in-memory pandas path (DataFrame -> BytesIO, widths over every cell) with the
+# streaming constant_memory writer in reports.write_excel_report, on synthetic deals-like rows.
+# Every (mode, size) pair runs in its own subprocess so peak RSS is measured in isolation.
+#
+# Usage: python benchmarks/bench_excel_report.py [--rows 10000 100000 1000000]
+
+import os
+import sys
+import time
+import random
+import resource
+import argparse
+import subprocess
+import tempfile
+from io import BytesIO
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COLUMNS = [
+    "Sales Status", "Sale Price", "Deposit", "Balance", "Commission", "Deposit Date", "Sale Price Date",
+    "Vendor First Name 1", "Vendor Surname 1", "Vendor Email 1", "Vendor Phone 1", "Vendor Boat Name",
+    "Vendor Boat Location", "Buyer First Name 1", "Buyer Surname 1", "Buyer Email 1", "Buyer Budget"
+]
+
+
+def synthetic_batches(rows : int, batch_size : int = 1000):
+
+    """
+    Deterministic fake report rows, generated batch by batch like a server-side cursor would
+    """
+
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for i in range(offset, min(rows, offset + batch_size)):
+            batch.append((
+                rnd.choice(["current", "completed", "canceled"]), Decimal(rnd.randint(20000, 150000)),
+                Decimal(rnd.randint(1000, 5000)), Decimal(rnd.randint(10000, 140000)), Decimal(rnd.randint(500, 5000)),
+                start + timedelta(days=i % 700), start + timedelta(days=i % 700 + 30),
+                f"Vendor{i}", f"Surname{i}", f"vendor{i}@example.com", f"07{i:09d}", f"Boat {i}",
+                rnd.choice(["Braunston", "Stoke Bruerne", "Market Harborough"]),
+                f"Buyer{i}", f"BuyerSurname{i}", f"buyer{i}@example.com", rnd.choice(["£25k-50k", "£50k-75k", "£100k+"])
+            ))
+        yield batch
+
+
+def run_legacy(rows : int) -> int:
+
+    """
+    The old generate_excel_report: whole DataFrame in memory, widths over every cell, BytesIO output
+    """
+
+    import pandas as pd
+
+    data = [dict(zip(COLUMNS, row)) for batch in synthetic_batches(rows) for row in batch]
+    df = pd.DataFrame(data)
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="Deals")
+        worksheet = writer.sheets["Deals"]
+
+        for idx, column in enumerate(df.columns):
+            col_width = max(len(str(column)), df[column].astype(str).map(len).max()) + 2
+            worksheet.set_column(idx, idx, col_width)
+
+    return len(output.getvalue())
+
+
+def run_streaming(rows : int) -> int:
+
+    """
+    reports.write_excel_report fed batch by batch, as from QueryStream
+    """
+
+    from reports import write_excel_report
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+
+    try:
+        write_excel_report(synthetic_batches(rows), COLUMNS, "deals", path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def child(mode : str, rows : int):
+
+    start = time.perf_counter()
+    size = run_legacy(rows) if mode == "legacy" else run_streaming(rows)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:<10} rows={rows:>8}  time={elapsed:7.2f}s  peak_rss={peak_mb:8.1f}MB  file={size / 1024 / 1024:.1f}MB", flush=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Excel report peak RSS and time, pandas vs streaming")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--modes", nargs="+", default=["legacy", "streaming"])
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], int(args.child[1]))
+        return
+
+    for rows in args.rows:
+        for mode in args.modes:
+            subprocess.run([sys.executable, __file__, "--child", mode, str(rows)], check=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Benchmark: schema pruning for sql_prompt
+#
+# For every question of the corpus compares the full schema with the pruned one:
+# prompt tokens, and recall of the tables the question really needs.
+# With --llm it also generates the SQL from both prompts, times it, runs both queries and checks
+# the pruned prompt gives the same result as the full one (accuracy must not drop).
+# Needs the same .env (DB and Gemini) as the app.
+#
+# Usage: python benchmarks/bench_schema_pruning.py [--corpus data/schema_pruning_corpus.jsonl] [--llm]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from schema_catalog import get_catalog
+from schema_selector import select_tables, relevant_schema
+from prompts import sql_prompt
+from utils import cleaned_sql, parse_vague_time_phrases, estimate_tokens
+from llm import llm_response
+from db import execute_query
+
+
+def timed_sql(question : str, schema : str) -> tuple[str, float]:
+
+    start = time.perf_counter()
+    sql = cleaned_sql(llm_response(sql_prompt(question, schema, "", parse_vague_time_phrases(question))))
+    return sql, time.perf_counter() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Full vs pruned schema in sql_prompt")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "data", "schema_pruning_corpus.jsonl"))
+    parser.add_argument("--llm", action="store_true", help="also generate and run the SQL with both schemas")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    catalog = get_catalog()
+    full_schema = catalog["prompt"]
+
+    totals = {"full_tokens": 0, "pruned_tokens": 0, "recall_hits": 0, "recall_total": 0,
+              "full_s": 0.0, "pruned_s": 0.0, "same_result": 0}
+
+    for row in corpus:
+        question = row["question"]
+        pruned_schema = relevant_schema(question)
+        selected = set(select_tables(question, catalog)) or set(catalog["tables"])
+
+        full_tokens = estimate_tokens(sql_prompt(question, full_schema, ""))
+        pruned_tokens = estimate_tokens(sql_prompt(question, pruned_schema, ""))
+        hits = len(set(row["tables"]) & selected)
+
+        totals["full_tokens"] += full_tokens
+        totals["pruned_tokens"] += pruned_tokens
+        totals["recall_hits"] += hits
+        totals["recall_total"] += len(row["tables"])
+
+        line = f"{question[:50]:<50} tokens {full_tokens:>6} -> {pruned_tokens:>6}  tables {hits}/{len(row['tables'])}"
+
+        if args.llm:
+            full_sql, full_s = timed_sql(question, full_schema)
+            pruned_sql, pruned_s = timed_sql(question, pruned_schema)
+            same = execute_query(full_sql) == execute_query(pruned_sql)
+
+            totals["full_s"] += full_s
+            totals["pruned_s"] += pruned_s
+            totals["same_result"] += same
+            line += f"  sql {full_s:.2f}s -> {pruned_s:.2f}s  {'same' if same else 'DIFFERENT'}"
+
+        print(line)
+
+    n = len(corpus)
+    print()
+    print(f"prompt tokens: {totals['full_tokens'] / n:.0f} -> {totals['pruned_tokens'] / n:.0f} avg "
+          f"({1 - totals['pruned_tokens'] / totals['full_tokens']:.1%} fewer)")
+    print(f"table recall:  {totals['recall_hits']}/{totals['recall_total']}")
+
+    if args.llm:
+        print(f"sql latency:   {totals['full_s'] / n:.2f}s -> {totals['pruned_s'] / n:.2f}s avg")
+        print(f"same result:   {totals['same_result']}/{n}")
+
+
+if __name__ == "__main__":
+    main()
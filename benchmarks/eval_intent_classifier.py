@@ -0,0 +1,59 @@
+# Evaluates the local intent classifier on a labelled test corpus
+#
+# Reports how many messages the fast path answers (= LLM calls saved) and how accurate those answers are.
+# Messages below the threshold would go to the LLM, so they do not count against accuracy.
+#
+# Usage: python benchmarks/eval_intent_classifier.py [--corpus data/intent_test_corpus.jsonl] [--threshold 0.8]
+
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import intent_classifier
+from intent_classifier import classify_intent, load_labelled
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Local intent classifier accuracy and LLM calls saved")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "data", "intent_test_corpus.jsonl"))
+    parser.add_argument("--threshold", type=float, default=intent_classifier.INTENT_CONFIDENCE_THRESHOLD)
+    args = parser.parse_args()
+
+    intent_classifier.INTENT_CONFIDENCE_THRESHOLD = args.threshold
+    pairs = load_labelled(args.corpus)
+
+    answered = 0
+    correct = 0
+    misses = []
+
+    start = time.perf_counter()
+    for text, label in pairs:
+        intent, confidence = classify_intent(text)
+
+        if intent is None:
+            continue
+
+        answered += 1
+        if intent == label:
+            correct += 1
+        else:
+            misses.append((text, label, intent, round(confidence, 3)))
+
+    elapsed = time.perf_counter() - start
+
+    print(f"messages:          {len(pairs)}")
+    print(f"fast path:         {answered} ({answered / len(pairs):.1%} LLM calls saved)")
+    print(f"fast path accuracy {correct}/{answered} ({correct / max(answered, 1):.1%})")
+    print(f"avg latency:       {elapsed / len(pairs) * 1e6:.1f} µs/message")
+
+    for text, label, intent, confidence in misses:
+        print(f"  wrong: {text!r} expected={label} got={intent} ({confidence})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# Boat name index for the brochure intent
+# Resolves the boat a message is about straight from the text, without an LLM call: seller boat names
+# from leads are kept in process in a trigram index, phrases of the message are matched against it and
+# ranked by edit distance, so "brochuer for claritta" still finds "Clarita".
+# The index is refreshed incrementally by leads.updated_at, with a full reload now and then for deletes.
+
+import os
+import re
+import time
+import threading
+from dotenv import load_dotenv
+
+from db import fetch_rows
+
+
+load_dotenv(override=True)
+
+BOAT_INDEX_REFRESH_SECONDS = float(os.getenv("BOAT_INDEX_REFRESH_SECONDS", "30"))
+BOAT_INDEX_FULL_RELOAD_SECONDS = float(os.getenv("BOAT_INDEX_FULL_RELOAD_SECONDS", "3600"))
+
+# Score (0..1, 1 - edit distance / length) needed for a confident match, and to be offered as a candidate
+BOAT_MATCH_THRESHOLD = float(os.getenv("BOAT_MATCH_THRESHOLD", "0.8"))
+BOAT_CANDIDATE_THRESHOLD = float(os.getenv("BOAT_CANDIDATE_THRESHOLD", "0.6"))
+
+# Two boats scoring within this of each other are ambiguous, the user gets to pick
+BOAT_AMBIGUITY_MARGIN = float(os.getenv("BOAT_AMBIGUITY_MARGIN", "0.1"))
+
+MAX_CANDIDATES = 5
+
+# Words of a brochure request that are never (a whole) boat name
+STOP_WORDS = {
+    "brochure", "brochures", "brochuer", "broucher", "brouchure", "pdf", "generate", "create", "make", "get",
+    "give", "send", "download", "show", "want", "need", "can", "could", "you", "please", "me", "i", "a", "an",
+    "the", "for", "of", "on", "about", "boat", "boats", "named", "called", "name", "vendor", "seller", "with"
+}
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+_lock = threading.Lock()
+
+_index = {
+    "by_id": {},         # lead id -> normalized name
+    "names": {},         # normalized name -> {"name": original name, "lead_ids": set()}
+    "grams": {},         # trigram -> set of normalized names
+    "max_words": 1,
+    "watermark": None,   # latest updated_at seen
+    "refreshed_at": 0.0,
+    "loaded_at": 0.0
+}
+
+boat_index_stats = {
+    "full_loads": 0,
+    "refreshes": 0,
+    "lookups": 0,
+    "resolved": 0,
+    "ambiguous": 0,
+    "unresolved": 0,
+    "lookup_us_total": 0.0
+}
+
+
+def normalize(text : str) -> str:
+
+    """
+    Lowercase words only, so 'Clarita-II' and 'clarita ii' are the same name
+    """
+    return " ".join(WORD_RE.findall(str(text).lower()))
+
+
+def trigrams(text : str) -> set:
+
+    """
+    Trigrams of a normalized name, padded so short names and word starts count too
+    """
+
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a : str, b : str) -> int:
+
+    """
+    Levenshtein distance (insert, delete, substitute)
+    """
+
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+
+    return previous[-1]
+
+
+def similarity(a : str, b : str) -> float:
+
+    return 1 - edit_distance(a, b) / max(len(a), len(b), 1)
+
+
+def _remove(lead_id):
+
+    name = _index["by_id"].pop(lead_id, None)
+    if name is None:
+        return
+
+    entry = _index["names"][name]
+    entry["lead_ids"].discard(lead_id)
+
+    if not entry["lead_ids"]:
+        del _index["names"][name]
+        for gram in trigrams(name):
+            names = _index["grams"].get(gram)
+            if names:
+                names.discard(name)
+                if not names:
+                    del _index["grams"][gram]
+
+
+def _add(lead_id, boat_name : str):
+
+    name = normalize(boat_name)
+    if not name:
+        return
+
+    _index["by_id"][lead_id] = name
+
+    entry = _index["names"].get(name)
+    if entry is None:
+        entry = _index["names"][name] = {"name": boat_name.strip(), "lead_ids": set()}
+        for gram in trigrams(name):
+            _index["grams"].setdefault(gram, set()).add(name)
+        _index["max_words"] = max(_index["max_words"], len(name.split()))
+
+    entry["lead_ids"].add(lead_id)
+
+
+def refresh(force : bool = False):
+
+    """
+    Brings the index up to date: only the leads changed since the last refresh are read,
+    everything is reloaded every BOAT_INDEX_FULL_RELOAD_SECONDS (to drop deleted leads)
+    """
+
+    now = time.time()
+
+    if not force and now - _index["refreshed_at"] < BOAT_INDEX_REFRESH_SECONDS:
+        return
+
+    with _lock:
+
+        # Someone else refreshed it while we were waiting
+        if not force and now - _index["refreshed_at"] < BOAT_INDEX_REFRESH_SECONDS:
+            return
+
+        full = force or _index["watermark"] is None or now - _index["loaded_at"] >= BOAT_INDEX_FULL_RELOAD_SECONDS
+
+        try:
+            if full:
+                rows = fetch_rows("SELECT id, seller_boat_name, updated_at FROM leads WHERE seller_boat_name IS NOT NULL AND seller_boat_name <> ''")
+            else:
+                # >= so rows updated in the same second as the watermark aren't missed, re-adding is harmless
+                rows = fetch_rows("SELECT id, seller_boat_name, updated_at FROM leads WHERE updated_at >= %s", (_index["watermark"],))
+
+        except Exception:
+            # A slightly stale index is still better than none
+            if not _index["loaded_at"]:
+                raise
+            return
+
+        if full:
+            _index.update({"by_id": {}, "names": {}, "grams": {}, "max_words": 1, "loaded_at": now})
+            boat_index_stats["full_loads"] += 1
+        else:
+            boat_index_stats["refreshes"] += 1
+
+        for lead_id, boat_name, updated_at in rows:
+            _remove(lead_id)
+            if boat_name:
+                _add(lead_id, boat_name)
+
+            if updated_at and (_index["watermark"] is None or updated_at > _index["watermark"]):
+                _index["watermark"] = updated_at
+
+        _index["refreshed_at"] = now
+
+
+def phrases(text : str, max_words : int) -> set:
+
+    """
+    Every run of up to max_words words in the text that isn't made of stop words only
+    """
+
+    words = normalize(text).split()
+    found = set()
+
+    for size in range(1, max_words + 1):
+        for start in range(len(words) - size + 1):
+            chunk = words[start:start + size]
+            if not all(word in STOP_WORDS for word in chunk):
+                found.add(" ".join(chunk))
+
+    return found
+
+
+def rank(text : str) -> list[tuple[str, float]]:
+
+    """
+    Boat names found in the text, best first, as (normalized name, score)
+    """
+
+    scores = {}
+
+    for phrase in phrases(text, _index["max_words"]):
+
+        if phrase in _index["names"]:
+            scores[phrase] = 1.0
+            continue
+
+        # Only names sharing enough trigrams with the phrase get the (slower) edit distance
+        grams = trigrams(phrase)
+        shared = {}
+        for gram in grams:
+            for name in _index["grams"].get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+
+        for name, count in shared.items():
+            # Too few shared trigrams, or lengths too far apart, can't reach the candidate score
+            if count < len(grams) / 3 or abs(len(name) - len(phrase)) > (1 - BOAT_CANDIDATE_THRESHOLD) * max(len(name), len(phrase)):
+                continue
+
+            score = similarity(phrase, name)
+            if score > scores.get(name, 0):
+                scores[name] = score
+
+    # On a tie the longer name wins, "clarita ii" over "clarita" when the text says "clarita ii"
+    return sorted(scores.items(), key=lambda item: (-item[1], -len(item[0]), item[0]))
+
+
+def resolve_boat_name(text : str) -> dict:
+
+    """
+    Finds the boat a message is about. Returns
+    {"match": boat name or None, "candidates": [{"name", "score", "lead_ids"}], "ambiguous": bool}
+    """
+
+    refresh()
+
+    start = time.perf_counter()
+
+    with _lock:
+        ranked = [(name, score) for name, score in rank(text) if score >= BOAT_CANDIDATE_THRESHOLD][:MAX_CANDIDATES]
+
+        candidates = [
+            {"name": _index["names"][name]["name"], "score": round(score, 3), "lead_ids": sorted(_index["names"][name]["lead_ids"])}
+            for name, score in ranked
+        ]
+
+    match = None
+    ambiguous = False
+
+    if candidates and candidates[0]["score"] >= BOAT_MATCH_THRESHOLD:
+        ambiguous = len(candidates) > 1 and candidates[0]["score"] - candidates[1]["score"] < BOAT_AMBIGUITY_MARGIN and candidates[0]["score"] < 1.0
+        if not ambiguous:
+            match = candidates[0]["name"]
+
+    elif candidates:
+        # Nothing close enough on its own, but something resembles a known boat
+        ambiguous = True
+
+    boat_index_stats["lookups"] += 1
+    boat_index_stats["lookup_us_total"] += (time.perf_counter() - start) * 1e6
+    boat_index_stats["resolved" if match else "ambiguous" if ambiguous else "unresolved"] += 1
+
+    return {"match": match, "candidates": candidates, "ambiguous": ambiguous}
+
+
+def get_boat_index_stats() -> dict:
+
+    """
+    Gets index size and lookup outcomes
+    """
+
+    lookups = boat_index_stats["lookups"]
+
+    return {
+        **boat_index_stats,
+        "lookup_us_total": round(boat_index_stats["lookup_us_total"], 1),
+        "lookup_us_avg": round(boat_index_stats["lookup_us_total"] / lookups, 1) if lookups else 0.0,
+        "boats": len(_index["names"]),
+        "leads": len(_index["by_id"]),
+        "trigrams": len(_index["grams"])
+    }
@@ -0,0 +1,237 @@
+# Bulk brochure pre-rendering
+# Brochures of every listed boat in one go (boat shows, mail-outs): brochures rows are streamed from a
+# server-side cursor and rendered across the render pool, unchanged rows come straight from the brochure cache.
+# The result is a streamed ZIP (with a manifest.json of what's in it and what failed), or just a warm cache.
+# A boat that fails to render is reported and skipped, it never stops the batch.
+
+import os
+import re
+import json
+import time
+import uuid
+import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from db import QueryStream
+from render_pool import render_map
+from brochures import render_brochure_pdf, brochure_etag, cached_brochure_pdf, cache_brochure_pdf
+
+
+load_dotenv(override=True)
+
+# Finished pre-render batches kept for their status endpoint
+BROCHURE_BATCH_HISTORY = int(os.getenv("BROCHURE_BATCH_HISTORY", "20"))
+
+LISTED_BROCHURES_SQL = """
+SELECT b.* FROM brochures b
+WHERE EXISTS (SELECT 1 FROM leads l WHERE l.seller_boat_name = b.name AND l.listed = 1)
+ORDER BY b.name
+"""
+
+ALL_BROCHURES_SQL = "SELECT * FROM brochures ORDER BY name"
+
+# One cache-filling batch at a time, they'd only compete for the render pool
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="brochure-batch")
+
+_batches = OrderedDict()
+_lock = threading.Lock()
+
+
+def new_summary(listed_only : bool) -> dict:
+
+    return {
+        "listed_only": listed_only,
+        "status": "running",
+        "boats": 0,
+        "rendered": 0,
+        "cached": 0,
+        "failed": [],
+        "seconds": 0.0,
+        "brochures_per_second": 0.0,
+        "started_at": time.time()
+    }
+
+
+def render_brochures(summary : dict):
+
+    """
+    Yields (boat name, etag, pdf bytes or None, error or None) for every brochure of the batch,
+    rendering only rows that aren't in the brochure cache already. Keeps summary up to date as it goes.
+    """
+
+    sql = LISTED_BROCHURES_SQL if summary["listed_only"] else ALL_BROCHURES_SQL
+    hits = []
+
+    def record(name, error=None, cached=False):
+        summary["boats"] += 1
+
+        if error is not None:
+            summary["failed"].append({"boat": name, "error": f"{type(error).__name__}: {error}"})
+        else:
+            summary["cached" if cached else "rendered"] += 1
+
+        summary["seconds"] = round(time.time() - summary["started_at"], 2)
+        summary["brochures_per_second"] = round(summary["boats"] / summary["seconds"], 2) if summary["seconds"] else 0.0
+
+    def misses(stream):
+        for row in stream:
+            etag = brochure_etag(row)
+            pdf = cached_brochure_pdf(etag)
+
+            if pdf is None:
+                yield row
+            else:
+                hits.append((row["name"], etag, pdf))
+
+    with QueryStream(sql, dictionary=True) as stream:
+
+        for row, pdf, error in render_map(render_brochure_pdf, misses(stream)):
+
+            # Cached ones found while the pool was busy
+            while hits:
+                hit = hits.pop(0)
+                record(hit[0], cached=True)
+                yield hit[0], hit[1], hit[2], None
+
+            etag = brochure_etag(row)
+            if error is None:
+                cache_brochure_pdf(etag, pdf)
+
+            record(row["name"], error)
+            yield row["name"], etag, pdf, error
+
+    while hits:
+        hit = hits.pop(0)
+        record(hit[0], cached=True)
+        yield hit[0], hit[1], hit[2], None
+
+    summary["status"] = "done"
+
+
+class ChunkBuffer:
+
+    """
+    Write-only file object for zipfile, what's written is handed out chunk by chunk.
+    It has no seek, so zipfile writes a streamable archive (data descriptors after each file).
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def pdf_filename(boat_name : str, used : set) -> str:
+
+    """
+    File name of a boat's brochure inside the archive, unique even for boats with the same name
+    """
+
+    base = f"brochure_vendor_{re.sub(r'[^A-Za-z0-9_-]+', '_', str(boat_name)).strip('_') or 'boat'}"
+    filename = f"{base}.pdf"
+
+    counter = 2
+    while filename in used:
+        filename = f"{base}_{counter}.pdf"
+        counter += 1
+
+    used.add(filename)
+    return filename
+
+
+def zip_brochures(listed_only : bool = True):
+
+    """
+    Generator of a ZIP archive with the brochures, written as they are rendered.
+    Ends with manifest.json: the files, the failed boats and the throughput.
+    Blocking, iterate it in a thread (StreamingResponse does for sync generators).
+    """
+
+    summary = new_summary(listed_only)
+    buffer = ChunkBuffer()
+    files = []
+    used = set()
+
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+
+        for boat_name, etag, pdf, error in render_brochures(summary):
+            if error is not None:
+                continue
+
+            filename = pdf_filename(boat_name, used)
+            archive.writestr(filename, pdf)
+            files.append({"boat": boat_name, "file": filename, "bytes": len(pdf), "etag": etag})
+
+            yield buffer.drain()
+
+        archive.writestr("manifest.json", json.dumps({**summary, "files": files}, indent=2, default=str))
+
+    yield buffer.drain()
+
+
+def run_prerender(summary : dict):
+
+    try:
+        for _ in render_brochures(summary):
+            pass
+
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+
+
+def start_prerender(listed_only : bool = True) -> dict:
+
+    """
+    Starts filling the brochure cache in the background, returns the batch status.
+    A batch already queued or running is returned instead of starting another.
+    """
+
+    with _lock:
+        for batch in _batches.values():
+            if batch["status"] in ("queued", "running") and batch["listed_only"] == listed_only:
+                return dict(batch)
+
+        batch_id = uuid.uuid4().hex
+        summary = {"batch_id": batch_id, **new_summary(listed_only), "status": "queued"}
+        _batches[batch_id] = summary
+
+        while len(_batches) > BROCHURE_BATCH_HISTORY:
+            _batches.popitem(last=False)
+
+    def run():
+        summary["status"] = "running"
+        summary["started_at"] = time.time()
+        run_prerender(summary)
+
+    executor.submit(run)
+
+    return dict(summary)
+
+
+def get_prerender(batch_id : str) -> dict | None:
+
+    """
+    Gets the status of a pre-render batch (None if unknown)
+    """
+
+    batch = _batches.get(batch_id)
+    return batch and dict(batch)
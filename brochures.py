@@ -1,122 +1,247 @@
 from fpdf import FPDF
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 import os
-from db import get_connection
+import json
+import hashlib
+import threading
+from cachetools import LRUCache
+from dotenv import load_dotenv
+from db import run_statement
+from async_db import run_db
+from render_pool import render_async
 import mysql.connector
 from fastapi import HTTPException
 
-def generate_brochure(boat_name: str):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM brochures WHERE name = %s", (boat_name,))
-        data = cursor.fetchone()
-
-        if not data:
-            raise HTTPException(status_code=404, detail="Brochure data not found. Please fill it from the Admin panel")
 
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.set_font("Arial", 'B', 16)
-
-        # Title
-        pdf.cell(0, 10, f"{data['name']} £{data['amount']}", ln=True, align='C')
-
-        def section(title):
-            pdf.ln(5)
-            pdf.set_font("Arial", 'B', 14)
-            pdf.cell(0, 10, title, ln=True)
-            pdf.set_font("Arial", '', 12)
-
-        def field(label, value):
-            if value not in [None, "None", "null", ""]:
-                pdf.cell(80, 8, f"{label}:", border=0)
-                pdf.cell(0, 8, str(value), ln=True)
-
-        # --- Sections ---
-        section("Basic Info")
-        field("Length/beam", data["length"])
-        field("No. of berths", data["no_of_berths"])
-        field("Stern type", data["stern_type"])
-        field("Engine", data["engine"])
-        field("Hull builder", data["hull_builder"])
-        field("Last service", data["last_service"])
-        field("Fit out", data["fit_out"])
-        field("Blacking", data["blacking"])
-        field("Year", data["year"])
-        field("Boat safety", data["boat_safety"])
-        field("Steel spec", data["steel_spec"])
-        field("Recent survey", data["recent_survey"])
-
-        section("History")
-        for key in ["cin_number", "crt_number", "licence_number", "no_of_owners", "engine_service_history", "boiler_service_history", "survey", "anodes", "documentation_available"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Engine Specs")
-        for key in ["engine_hours", "engine_gearbox", "engine_bow_thruster", "engine_weed_hatch", "diesel_tank_capacity", "engine_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Dimensions")
-        for key in ["draft", "internal_headroom", "saloon", "galley", "bathroom", "bedroom"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Heating & Hot Water")
-        for key in ["central_heating", "solid_fuel_stove", "source_of_hot_water", "water_tank", "water_tank_capacity", "heating_system_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Electrical System")
-        for key in ["alternator", "batteries", "lighting", "inverter_charger", "landline_socket", "generator", "electrical_system_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Gas System")
-        for key in ["gas_bottles", "appliances", "gas_system_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Cabin Fitout")
-        for key in ["insulation", "ballast", "ceiling", "cabin_sides", "hull_sides", "flooring", "side_doors", "windows", "cabin_fit_out_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Galley")
-        for key in ["cooker", "fridge_freezer", "microwave", "washing_machine", "galley_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Bathroom")
-        for key in ["toilet", "waste_tank_capacity", "bath_shower", "vanity_basin", "bathroom_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Bedroom")
-        for key in ["bed", "dinette", "bedroom_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        section("Other")
-        for key in ["tv", "covers", "navigation_equipment", "other_extras"]:
-            field(key.replace("_", " ").title(), data.get(key))
-
-        # Footer Disclaimer
-        pdf.ln(10)
-        pdf.set_font("Arial", '', 10)
-        pdf.multi_cell(0, 8, """For further information, arrange a viewing or make an offer, please call Noel on 07960 768724
+load_dotenv(override=True)
+
+# Rendered PDFs are kept in memory by content hash of their brochures row, bounded by bytes
+BROCHURE_CACHE_MAX_BYTES = int(os.getenv("BROCHURE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+brochure_cache = LRUCache(maxsize=BROCHURE_CACHE_MAX_BYTES, getsizeof=len)
+brochure_cache_lock = threading.Lock()
+
+brochure_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "not_modified": 0
+}
+
+
+def find_brochure_lead(boat_name: str) -> tuple:
+    """
+    Looks up the seller lead of a boat and whether its brochure data is filled in, in a single query.
+    Returns (lead_id, brochure_available), lead_id is None when there is no such boat.
+    """
+    rows = run_statement("brochure_lookup", (boat_name, boat_name))
+
+    if not rows:
+        return None, False
+
+    lead_id, brochure_available = rows[0]
+    return lead_id, bool(brochure_available)
+
+
+def fetch_brochure_data(boat_name: str):
+    """
+    Fetches the brochure row of a boat (None if it is not filled in)
+    """
+    rows = run_statement("brochure_row", (boat_name,), dictionary=True)
+    return rows[0] if rows else None
+
+
+def brochure_etag(data: dict) -> str:
+    """
+    Content hash of a brochures row, any edit from the admin panel gives a new one
+    """
+    content = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Checks an If-None-Match header against our ETag
+    """
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def render_brochure_pdf(data: dict) -> bytes:
+    """
+    Render process entry point: builds the brochure PDF of a brochures row, in memory
+    """
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_font("Arial", 'B', 16)
+
+    # Title
+    pdf.cell(0, 10, f"{data['name']} £{data['amount']}", ln=True, align='C')
+
+    def section(title):
+        pdf.ln(5)
+        pdf.set_font("Arial", 'B', 14)
+        pdf.cell(0, 10, title, ln=True)
+        pdf.set_font("Arial", '', 12)
+
+    def field(label, value):
+        if value not in [None, "None", "null", ""]:
+            pdf.cell(80, 8, f"{label}:", border=0)
+            pdf.cell(0, 8, str(value), ln=True)
+
+    # --- Sections ---
+    section("Basic Info")
+    field("Length/beam", data["length"])
+    field("No. of berths", data["no_of_berths"])
+    field("Stern type", data["stern_type"])
+    field("Engine", data["engine"])
+    field("Hull builder", data["hull_builder"])
+    field("Last service", data["last_service"])
+    field("Fit out", data["fit_out"])
+    field("Blacking", data["blacking"])
+    field("Year", data["year"])
+    field("Boat safety", data["boat_safety"])
+    field("Steel spec", data["steel_spec"])
+    field("Recent survey", data["recent_survey"])
+
+    section("History")
+    for key in ["cin_number", "crt_number", "licence_number", "no_of_owners", "engine_service_history", "boiler_service_history", "survey", "anodes", "documentation_available"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Engine Specs")
+    for key in ["engine_hours", "engine_gearbox", "engine_bow_thruster", "engine_weed_hatch", "diesel_tank_capacity", "engine_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Dimensions")
+    for key in ["draft", "internal_headroom", "saloon", "galley", "bathroom", "bedroom"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Heating & Hot Water")
+    for key in ["central_heating", "solid_fuel_stove", "source_of_hot_water", "water_tank", "water_tank_capacity", "heating_system_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Electrical System")
+    for key in ["alternator", "batteries", "lighting", "inverter_charger", "landline_socket", "generator", "electrical_system_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Gas System")
+    for key in ["gas_bottles", "appliances", "gas_system_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Cabin Fitout")
+    for key in ["insulation", "ballast", "ceiling", "cabin_sides", "hull_sides", "flooring", "side_doors", "windows", "cabin_fit_out_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Galley")
+    for key in ["cooker", "fridge_freezer", "microwave", "washing_machine", "galley_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Bathroom")
+    for key in ["toilet", "waste_tank_capacity", "bath_shower", "vanity_basin", "bathroom_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Bedroom")
+    for key in ["bed", "dinette", "bedroom_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    section("Other")
+    for key in ["tv", "covers", "navigation_equipment", "other_extras"]:
+        field(key.replace("_", " ").title(), data.get(key))
+
+    # Footer Disclaimer
+    pdf.ln(10)
+    pdf.set_font("Arial", '', 10)
+    pdf.multi_cell(0, 8, """For further information, arrange a viewing or make an offer, please call Noel on 07960 768724
 
 PLEASE NOTE: The Boat Brokers are acting as Brokers only. Whilst every care has been taken in their preparation, the correctness of these particulars is not guaranteed. They do not form part of any current or future contract. Prospective purchasers are advised to have an independent survey carried out by a qualified marine surveyor prior to completion of purchase.
 
 The Boat Brokers is a trading name of Creary Holdings Ltd. Company no: 14876430
 """)
 
-        # Save and return
-        filename = f"brochure_vendor_{boat_name}.pdf"
-        filepath = f"./{filename}"
-        pdf.output(filepath)
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def cached_brochure_pdf(etag: str) -> bytes | None:
+    """
+    Gets a rendered PDF from the cache by its row hash (None if not cached)
+    """
+    with brochure_cache_lock:
+        pdf = brochure_cache.get(etag)
+
+    brochure_cache_stats["hits" if pdf is not None else "misses"] += 1
+    return pdf
+
+
+def cache_brochure_pdf(etag: str, pdf: bytes):
+    """
+    Keeps a rendered PDF in the cache (unless it's bigger than the whole cache)
+    """
+    if len(pdf) <= BROCHURE_CACHE_MAX_BYTES:
+        with brochure_cache_lock:
+            brochure_cache[etag] = pdf
+
+
+async def get_brochure_pdf(data: dict) -> tuple[bytes, str]:
+    """
+    Gets the PDF of a brochures row from the cache, rendering it only when the row is new or changed.
+    Returns (pdf bytes, etag).
+    """
+    etag = brochure_etag(data)
+
+    pdf = cached_brochure_pdf(etag)
+    if pdf is not None:
+        return pdf, etag
+
+    # FPDF is CPU-bound pure Python, so it runs in the render pool
+    pdf = await render_async(render_brochure_pdf, data)
+    cache_brochure_pdf(etag, pdf)
 
-        return FileResponse(filepath, media_type="application/pdf", filename=filename)
+    return pdf, etag
+
+
+async def generate_brochure(boat_name: str, if_none_match: str = None):
+    try:
+        data = await run_db(fetch_brochure_data, boat_name)
+
+        if not data:
+            raise HTTPException(status_code=404, detail="Brochure data not found. Please fill it from the Admin panel")
+
+        # Clients revalidate with the ETag, an unchanged row costs one SELECT and no rendering
+        etag = brochure_etag(data)
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+
+        if etag_matches(if_none_match, etag):
+            brochure_cache_stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+        pdf, _ = await get_brochure_pdf(data)
+
+        return Response(
+            pdf,
+            media_type="application/pdf",
+            headers={**headers, "Content-Disposition": f"attachment; filename=brochure_vendor_{boat_name}.pdf"}
+        )
 
     except mysql.connector.Error as err:
         raise HTTPException(status_code=500, detail=str(err))
 
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+
+def get_brochure_cache_stats() -> dict:
+    """
+    Gets hit rate, entries and bytes held by the brochure PDF cache
+    """
+    lookups = brochure_cache_stats["hits"] + brochure_cache_stats["misses"]
+
+    return {
+        **brochure_cache_stats,
+        "entries": len(brochure_cache),
+        "bytes": brochure_cache.currsize,
+        "max_bytes": BROCHURE_CACHE_MAX_BYTES,
+        "hit_rate": round(brochure_cache_stats["hits"] / lookups, 3) if lookups else 0.0
+    }
 
 
 
@@ -182,7 +307,7 @@ The Boat Brokers is a trading name of Creary Holdings Ltd. Company no: 14876430
 #         # Save to file
 #         filename = f"brochure_vendor_{boat_name}.pdf"
 #         filepath = f"./{filename}"
-#         pdf.output(filepath)
+#         return pdf.output(dest='S').encode('latin-1')
 
 #         return FileResponse(filepath, media_type="application/pdf", filename=filename)
 
@@ -1,39 +1,76 @@
 # Database related all functions here
 
 import os
+import time
+import weakref
+import threading
+import contextvars
+from contextlib import contextmanager
 # import mysql.connector
 from mysql.connector import errorcode
 from dotenv import load_dotenv
-import mysql.connector.pooling
+import mysql.connector
+
+from db_pool import ManagedPool
 
 
 load_dotenv(override=True)
 
 pool = None
+_pool_lock = threading.Lock()
+
+# Rows per fetchmany round trip of the streaming API
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "1000"))
+
+# Connection pool sizing, see db_pool.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "5"))
+DB_POOL_MAX_WAITERS = int(os.getenv("DB_POOL_MAX_WAITERS", "100"))
+
+
+def get_pool() -> ManagedPool:
 
-def get_connection():
-    
     """
-    Gets the connection with the database
+    Gets the connection pool, created on first use
     """
+
     global pool
 
+    if pool is None:
+        with _pool_lock:
+            if pool is None:
+                pool = ManagedPool(
+                    {
+                        "database": os.getenv("DB_NAME"),
+                        "host": os.getenv("DB_HOST"),
+                        "user": os.getenv("DB_USER"),
+                        "password": os.getenv("DB_PASSWORD"),
+                        "port": os.getenv("DB_PORT"),
+                        "auth_plugin": "mysql_native_password",
+                        "connect_timeout": 30,
+                        "raise_on_warnings": True
+                    },
+                    size=DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    ping_after=DB_POOL_PING_AFTER,
+                    max_waiters=DB_POOL_MAX_WAITERS,
+                    on_close=release_statements
+                )
+
+    return pool
+
+
+def get_connection(timeout : float = None):
+    
+    """
+    Gets the connection with the database, waiting up to DB_POOL_TIMEOUT seconds for a free one
+    """
+
     try:
-        if pool is None:
-            pool = mysql.connector.pooling.MySQLConnectionPool(
-                pool_name='boat_pool',
-                pool_size=10,
-                database = os.getenv("DB_NAME"),
-                host = os.getenv("DB_HOST"),
-                user = os.getenv("DB_USER"),
-                password = os.getenv("DB_PASSWORD"),
-                port = os.getenv("DB_PORT"),
-                auth_plugin = "mysql_native_password",
-                connect_timeout = 30,
-                raise_on_warnings = True
-            )
-
-        return pool.get_connection()
+        return get_pool().acquire(timeout)
     
     except mysql.connector.Error as e:
         
@@ -42,81 +79,467 @@ def get_connection():
         
         else:
             raise Exception(f"Database Connection Error {str(e)}")
+
+
+def get_pool_stats() -> dict:
+
+    """
+    Gets the pool gauges (in use, idle, waiters, acquire latency)
+    """
+
+    return get_pool().stats()
+
+
+def check_ready(timeout : float = 2.0) -> dict:
+
+    """
+    Readiness check: borrows a connection and pings the server.
+    Returns {"ready": bool, "error": str or None, "pool": pool stats}
+    """
+
+    error = None
+    conn = None
+
+    try:
+        conn = get_connection(timeout)
+        conn.ping(reconnect=False)
+
+    except Exception as e:
+        error = str(e)
+
+    finally:
+        if conn:
+            conn.close()
+
+    return {"ready": error is None, "error": error, "pool": get_pool_stats()}
         
     
-def fetch_schema():
-    
+# Request-scoped unit of work: inside a request every DB helper shares one connection,
+# checked out on first use and given back once the response is finished (see async_db.RequestConnectionMiddleware)
+class UnitOfWork:
+
     """
-    Fetches the whole database as schema
+    At most one lazily checked out connection, shared by all the DB calls of one request.
+    The calls may come from different threads (run_db), so they take turns with the lock.
     """
-    
+
+    def __init__(self):
+
+        self.conn = None
+        self.lock = threading.RLock()
+        self.calls = 0
+
+    def connection(self):
+
+        if self.conn is None:
+            self.conn = get_connection()
+            unit_stats["checkouts"] += 1
+        else:
+            unit_stats["reused"] += 1
+
+        self.calls += 1
+        return self.conn
+
+    def release(self):
+
+        """
+        Gives the connection back to the pool (a later DB call checks out a new one)
+        """
+
+        with self.lock:
+            if self.conn is not None:
+                conn, self.conn = self.conn, None
+                conn.close()
+
+
+_unit = contextvars.ContextVar("unit_of_work", default=None)
+
+unit_stats = {"requests": 0, "checkouts": 0, "reused": 0}
+
+
+def begin_unit() -> tuple:
+
+    """
+    Starts a unit of work in the current context, returns (unit, token) for end_unit
+    """
+
+    unit = UnitOfWork()
+    unit_stats["requests"] += 1
+
+    return unit, _unit.set(unit)
+
+
+def end_unit(token):
+
+    """
+    Ends the unit of work started with token (same context as begin_unit).
+    Its connection still has to be released, that's blocking so the caller does it with unit.release()
+    """
+
+    _unit.reset(token)
+
+
+def release_request_connection():
+
+    """
+    Gives the current request's connection back early (e.g. before a long LLM stream), if it has one
+    """
+
+    unit = _unit.get()
+    if unit is not None:
+        unit.release()
+
+
+@contextmanager
+def use_connection(conn = None):
+
+    """
+    Connection for one DB call: conn if given, the request's shared connection inside a unit of work,
+    otherwise a pooled one that goes back to the pool afterwards (also on errors)
+    """
+
+    if conn is not None:
+        yield conn
+        return
+
+    unit = _unit.get()
+
+    if unit is not None:
+        with unit.lock:
+            try:
+                yield unit.connection()
+            except Exception:
+                # The connection may be broken, the next call of the request starts on a fresh one
+                unit.release()
+                raise
+        return
+
+    conn = get_connection()
+
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        yield conn
+    finally:
+        conn.close()
 
-        cursor.execute("SHOW TABLES")
-        tables = [t[0] for t in cursor.fetchall()]
 
-        schema = ""
+def get_unit_stats() -> dict:
 
-        for table in tables:
-            
-            cursor.execute(f"SHOW COLUMNS FROM {table}")
-            columns = [col[0] for col in cursor.fetchall()]
+    """
+    Gets how many requests used the DB and how often their connection was reused
+    """
+
+    return {
+        **unit_stats,
+        "checkouts_per_request": round(unit_stats["checkouts"] / unit_stats["requests"], 3) if unit_stats["requests"] else 0.0
+    }
 
-            schema += f"{table}({','.join(columns)})\n"
 
-        return schema
+def fetch_schema():
+    
+    """
+    Fetches the whole database as schema (served from the in-process schema catalog)
+    """
+
+    # Imported here as schema_catalog itself depends on get_connection
+    from schema_catalog import get_schema_prompt
+
+    try:
+        return get_schema_prompt()
 
     except Exception as e:
         return f"Error: {str(e)}"
-    
-    finally:
 
-        if cursor:
-            cursor.close()
 
-        if conn:
-            conn.close()
+def fetch_rows(sql : str, params = None, dictionary : bool = False, with_columns : bool = False):
+
+    """
+    Executes the sql query (optionally parameterized) and fetch all rows, raising on errors.
+    With with_columns it returns (column names, rows) taken from cursor.description.
+    """
+
+    with use_connection() as conn:
 
+        cursor = conn.cursor(dictionary=dictionary)
 
-def execute_query(sql : str):
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+            if with_columns:
+                return [col[0] for col in cursor.description or []], rows
+
+            return rows
+
+        finally:
+            cursor.close()
+
+
+def execute_query(sql : str, params = None, dictionary : bool = False, with_columns : bool = False):
 
     """
     Executes the sql query and fetch result from Database
     """
 
-    cursor = None
-    conn = None
-    
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(sql)
-        result = cursor.fetchall()
-
-        return result
+        return fetch_rows(sql, params, dictionary, with_columns)
     
     except Exception as e:
         return f"Error: {str(e)}"
-    
-    finally:
 
-        if cursor:
+
+class QueryStream:
+
+    """
+    Streams a query result with an unbuffered (server-side) cursor, fetchmany batch by batch,
+    so memory stays constant whatever the size of the result.
+    It always checks out a connection of its own, nothing else can run on a connection
+    while an unbuffered result is being read.
+
+    with QueryStream("SELECT * FROM leads", dictionary=True) as stream:
+        for batch in stream.batches():
+            ...
+
+    The connection goes back to the pool on close, also when the consumer stops early.
+    """
+
+    def __init__(self, sql : str, params = None, dictionary : bool = False, batch_size : int = None):
+
+        self.sql = sql
+        self.params = params
+        self.dictionary = dictionary
+        self.batch_size = batch_size or QUERY_BATCH_SIZE
+
+        self.conn = None
+        self.cursor = None
+        self.columns = []
+        self.description = []
+        self.rows_read = 0
+        self.exhausted = False
+
+    def open(self):
+
+        """
+        Checks out a connection and starts the query (rows are not read yet)
+        """
+
+        try:
+            self.conn = get_connection()
+            self.cursor = self.conn.cursor(buffered=False, dictionary=self.dictionary)
+            self.cursor.execute(self.sql, self.params)
+            self.description = list(self.cursor.description or [])
+            self.columns = [col[0] for col in self.description]
+
+        except Exception:
+            self.close()
+            raise
+
+        return self
+
+    def fetch_batch(self) -> list:
+
+        """
+        Reads the next batch of rows, empty list once the result is exhausted
+        """
+
+        if self.exhausted:
+            return []
+
+        rows = self.cursor.fetchmany(self.batch_size)
+
+        if not rows:
+            self.exhausted = True
+
+        self.rows_read += len(rows)
+        return rows
+
+    def batches(self):
+
+        """
+        Yields the rows batch by batch
+        """
+
+        while True:
+            rows = self.fetch_batch()
+            if not rows:
+                return
+            yield rows
+
+    def __iter__(self):
+
+        for rows in self.batches():
+            yield from rows
+
+    def close(self):
+
+        """
+        Releases the cursor and returns the connection to the pool.
+        A connection left with unread rows (consumer stopped early) is closed instead: draining the rest
+        of a big result over the network just to reuse the connection costs more than opening a new one.
+        """
+
+        try:
+            if self.conn and not self.exhausted and self.conn.unread_result:
+                self.conn.discard()
+
+            elif self.cursor:
+                self.cursor.close()
+
+        except Exception:
+            pass
+
+        finally:
+            if self.conn:
+                self.conn.close()
+
+            self.cursor = None
+            self.conn = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_query(sql : str, params = None, dictionary : bool = False, batch_size : int = None, batches : bool = False):
+
+    """
+    Generator over a query result with constant memory, yields rows (or lists of rows with batches=True)
+    """
+
+    with QueryStream(sql, params, dictionary, batch_size) as stream:
+
+        if batches:
+            yield from stream.batches()
+        else:
+            yield from stream
+
+
+# Registry of the fixed queries the app runs over and over, by name.
+# They run as server-side prepared statements (binary protocol, values never spliced into the SQL),
+# prepared once per pooled connection and kept for its whole life (the pool rolls back a returned
+# connection instead of resetting its session, so the statements survive).
+STATEMENTS = {}
+
+statement_stats = {}
+
+# raw connection -> {(statement name, dictionary): prepared cursor}
+_prepared = weakref.WeakKeyDictionary()
+_statement_lock = threading.Lock()
+
+
+def register_statement(name : str, sql : str):
+
+    """
+    Adds a named statement to the registry (%s placeholders)
+    """
+
+    STATEMENTS[name] = sql
+    statement_stats[name] = {"calls": 0, "errors": 0, "prepares": 0, "ms_total": 0.0, "ms_max": 0.0}
+
+
+def prepared_cursor(conn, name : str, dictionary : bool = False):
+
+    """
+    Gets the prepared cursor of a statement on a connection, preparing it on first use
+    """
+
+    conn = getattr(conn, "raw", conn)
+
+    with _statement_lock:
+        cursors = _prepared.setdefault(conn, {})
+
+    cursor = cursors.get((name, dictionary))
+
+    if cursor is None:
+        cursor = cursors[(name, dictionary)] = conn.cursor(prepared=True, dictionary=dictionary)
+        statement_stats[name]["prepares"] += 1
+
+    return cursor
+
+
+def release_statements(conn):
+
+    """
+    Closes the prepared statements of a connection, before the pool closes it
+    """
+
+    with _statement_lock:
+        cursors = _prepared.pop(getattr(conn, "raw", conn), {})
+
+    for cursor in cursors.values():
+        try:
             cursor.close()
+        except Exception:
+            pass
 
-        if conn:
-            conn.close()
 
-    
+def run_statement(name : str, params = (), dictionary : bool = False, conn = None) -> list:
 
+    """
+    Runs a registered statement and fetches all its rows, raising on errors.
+    Runs on conn when given, otherwise on the request's (or a pooled) connection.
+    """
 
+    sql = STATEMENTS[name]
+    stats = statement_stats[name]
+    start = time.perf_counter()
 
+    try:
+        with use_connection(conn) as conn:
+            try:
+                cursor = prepared_cursor(conn, name, dictionary)
+                cursor.execute(sql, params)
+                return cursor.fetchall()
 
+            except Exception:
+                # Prepared again on the next call, in case the statement itself went bad
+                with _statement_lock:
+                    _prepared.get(getattr(conn, "raw", conn), {}).pop((name, dictionary), None)
+                raise
 
+    except Exception:
+        stats["errors"] += 1
+        raise
+
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        stats["calls"] += 1
+        stats["ms_total"] += elapsed
+        stats["ms_max"] = max(stats["ms_max"], elapsed)
+
+
+def get_statement_stats() -> dict:
+
+    """
+    Gets per-statement call counts and latency
+    """
+
+    return {
+        name: {
+            **stats,
+            "ms_total": round(stats["ms_total"], 2),
+            "ms_max": round(stats["ms_max"], 2),
+            "ms_avg": round(stats["ms_total"] / stats["calls"], 2) if stats["calls"] else 0.0
+        }
+        for name, stats in statement_stats.items()
+    }
+
+
+# Seller lead of a boat and whether its brochure is filled in, one round trip
+register_statement(
+    "brochure_lookup",
+    """
+    SELECT l.id, EXISTS(SELECT 1 FROM brochures b WHERE b.name = %s) AS brochure_available
+    FROM leads l
+    WHERE l.seller_boat_name = %s
+    LIMIT 1
+    """
+)
+
+# Brochure row of a boat, for the PDF
+register_statement("brochure_row", "SELECT * FROM brochures WHERE name = %s LIMIT 1")
 
 
-        
 # ans = execute_query("SELECT * FROM leads;")
-# print(ans)
\ No newline at end of file
+# print(ans)
@@ -0,0 +1,288 @@
+# Managed MySQL connection pool
+# mysql-connector's own pool raises straight away when all connections are checked out and never checks
+# a connection before handing it out. This one queues callers (bounded) until a connection frees up or
+# the acquire timeout passes, pings connections that sat idle before lending them (reconnecting dead ones),
+# recycles connections older than their max lifetime, and keeps gauges of its state.
+
+import time
+import threading
+from collections import deque
+import mysql.connector
+
+
+class PoolTimeout(Exception):
+
+    """
+    No connection became free within the acquire timeout (or too many callers were already waiting)
+    """
+
+
+class PooledConnection:
+
+    """
+    A borrowed connection. Everything is delegated to the underlying MySQLConnection,
+    except close(), which gives it back to the pool.
+    """
+
+    def __init__(self, pool, raw, created_at : float):
+
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __getattr__(self, name):
+
+        if self._raw is None:
+            raise AttributeError(f"Connection already returned to the pool ({name})")
+
+        return getattr(self._raw, name)
+
+    def close(self):
+
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool._release(raw, self._created_at)
+
+    def discard(self):
+
+        """
+        Closes the connection instead of giving it back (e.g. with an unread result that isn't worth draining),
+        the pool opens a new one in its place
+        """
+
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool._close_raw(raw)
+            self._pool._discard(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+
+        # Dropped without close(): free the slot so the pool doesn't shrink for good
+        if getattr(self, "_raw", None) is not None:
+            self._pool._discard(self._raw, leaked=True)
+
+
+class ManagedPool:
+
+    """
+    Fixed-size connection pool with a bounded wait queue.
+
+    size          connections at most
+    timeout       seconds a caller waits for a free connection before PoolTimeout
+    max_lifetime  seconds after which a connection is closed and replaced on its next borrow
+    ping_after    connections idle for longer than this are pinged (and reconnected) before being lent
+    max_waiters   callers allowed to wait at once, more get PoolTimeout immediately
+    on_close      called with a raw connection before the pool closes it
+    """
+
+    def __init__(self, config : dict, size : int = 10, timeout : float = 10.0, max_lifetime : float = 1800.0,
+                 ping_after : float = 5.0, max_waiters : int = 100, on_close = None):
+
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.max_waiters = max_waiters
+        self.on_close = on_close
+
+        self.idle = deque()  # (raw connection, created_at, last_used), most recently used last
+        self.open = 0
+        self.in_use = 0
+        self.waiters = 0
+        self.cond = threading.Condition()
+
+        self.acquire_ms = deque(maxlen=1000)
+        self.counters = {
+            "acquired": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "created": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "broken": 0,
+            "leaked": 0
+        }
+
+    def _connect(self):
+
+        raw = mysql.connector.connect(**self.config)
+        self.counters["created"] += 1
+        return raw
+
+    def _close_raw(self, raw):
+
+        try:
+            if self.on_close:
+                self.on_close(raw)
+            raw.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout : float = None) -> PooledConnection:
+
+        """
+        Borrows a connection, waiting up to timeout seconds for one to free up
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+
+        with self.cond:
+
+            if not self.idle and self.open >= self.size and self.waiters >= self.max_waiters:
+                self.counters["rejected"] += 1
+                raise PoolTimeout(f"Database pool exhausted ({self.in_use}/{self.size} in use, {self.waiters} already waiting)")
+
+            self.waiters += 1
+
+            try:
+                while not self.idle and self.open >= self.size:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {timeout:g}s waiting for a database connection "
+                            f"({self.in_use}/{self.size} in use, {self.waiters - 1} others waiting)"
+                        )
+
+                    self.cond.wait(remaining)
+
+            finally:
+                self.waiters -= 1
+
+            # Most recently used first, it's the least likely to have gone stale
+            entry = self.idle.pop() if self.idle else None
+
+            if entry is None:
+                self.open += 1
+
+            self.in_use += 1
+
+        # Network round trips happen outside the lock
+        try:
+            raw, created_at = self._checkout(entry)
+
+        except Exception:
+            with self.cond:
+                self.open -= 1
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+
+        with self.cond:
+            self.counters["acquired"] += 1
+            self.acquire_ms.append((time.perf_counter() - start) * 1000)
+
+        return PooledConnection(self, raw, created_at)
+
+    def _checkout(self, entry) -> tuple:
+
+        """
+        Makes sure the connection about to be lent works: new, recycled, or pinged if it sat idle
+        """
+
+        now = time.time()
+
+        if entry is None:
+            return self._connect(), now
+
+        raw, created_at, last_used = entry
+
+        if now - created_at >= self.max_lifetime:
+            self.counters["recycled"] += 1
+            self._close_raw(raw)
+            return self._connect(), now
+
+        if now - last_used >= self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+
+            except Exception:
+                self.counters["ping_failures"] += 1
+                self._close_raw(raw)
+                return self._connect(), now
+
+        return raw, created_at
+
+    def _release(self, raw, created_at : float):
+
+        """
+        Takes a connection back: unread results are discarded and the open transaction rolled back,
+        so the next borrower starts clean. A connection that can't be cleaned up is closed.
+        """
+
+        try:
+            if raw.unread_result:
+                raw.consume_results()
+            raw.rollback()
+
+        except Exception:
+            self.counters["broken"] += 1
+            self._close_raw(raw)
+            self._discard(raw)
+            return
+
+        with self.cond:
+            self.in_use -= 1
+            self.idle.append((raw, created_at, time.time()))
+            self.cond.notify()
+
+    def _discard(self, raw, leaked : bool = False):
+
+        """
+        Forgets a borrowed connection (closed or lost), freeing its slot for a new one
+        """
+
+        with self.cond:
+            self.open -= 1
+            self.in_use -= 1
+            if leaked:
+                self.counters["leaked"] += 1
+            self.cond.notify()
+
+    def close_all(self):
+
+        """
+        Closes the idle connections (borrowed ones are closed when given back)
+        """
+
+        with self.cond:
+            idle, self.idle = list(self.idle), deque()
+            self.open -= len(idle)
+
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self) -> dict:
+
+        """
+        Pool gauges (open, in use, idle, waiters) and acquire latency
+        """
+
+        with self.cond:
+            samples = sorted(self.acquire_ms)
+
+            return {
+                "size": self.size,
+                "open": self.open,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "waiters": self.waiters,
+                **self.counters,
+                "acquire_ms_avg": round(sum(samples) / len(samples), 2) if samples else 0.0,
+                "acquire_ms_p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else 0.0,
+                "acquire_ms_max": round(samples[-1], 2) if samples else 0.0
+            }
@@ -0,0 +1,158 @@
+# Token-budgeted conversation history for the prompts
+# The last HISTORY_VERBATIM_TURNS turns go into the prompt as they are, older turns are folded into
+# a rolling per-session summary. The summary is updated in the background after the request,
+# so it never adds an LLM round trip to the hot path.
+
+import os
+import asyncio
+import hashlib
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+from llm import llm_response_async
+from prompts import summary_prompt
+from utils import estimate_tokens
+
+
+load_dotenv(override=True)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_VERBATIM_TURNS = int(os.getenv("HISTORY_VERBATIM_TURNS", "4"))
+
+# summaries = {session_id: {"summary": "...", "last_folded": "<hash of the last message folded in>"}}
+summaries = TTLCache(maxsize=int(os.getenv("MEMORY_MAX_SESSIONS", "1000")), ttl=float(os.getenv("MEMORY_IDLE_TTL", "3600")))
+
+history_stats = {
+    "requests": 0,
+    "compacted": 0,
+    "tokens_full": 0,
+    "tokens_sent": 0,
+    "summaries_updated": 0,
+    "summary_errors": 0
+}
+
+_updating = set()
+
+# The event loop only keeps weak references to tasks, these are kept here until they finish
+_tasks = set()
+
+
+def message_hash(message : str) -> str:
+    return hashlib.sha1(message.encode("utf-8")).hexdigest()
+
+
+def covered_count(session_id : str, history_list : list[str]) -> int:
+
+    """
+    How many of the messages at the start of history_list the summary already covers
+    """
+
+    entry = summaries.get(session_id)
+    if not entry:
+        return 0
+
+    for idx in range(len(history_list) - 1, -1, -1):
+        if message_hash(history_list[idx]) == entry["last_folded"]:
+            return idx + 1
+
+    # The last folded message was already trimmed from memory, so none of the current ones are covered
+    return 0
+
+
+def fit_to_budget(summary : str, recent : list[str], budget : int) -> str:
+
+    """
+    Joins summary + recent messages, dropping the oldest recent turns (then cutting the summary) to fit the budget
+    """
+
+    recent = list(recent)
+
+    def render():
+        parts = [f"SUMMARY OF EARLIER CONVERSATION:\n{summary}"] if summary else []
+        return "\n".join(parts + recent)
+
+    text = render()
+
+    while estimate_tokens(text) > budget and len(recent) > 2:
+        del recent[:2]
+        text = render()
+
+    if estimate_tokens(text) > budget and summary:
+        summary = summary[: max(0, len(summary) - (estimate_tokens(text) - budget) * 4)]
+        text = render()
+
+    return text
+
+
+async def update_summary(session_id : str, messages : list[str]):
+
+    """
+    Folds the given messages into the session summary (runs in the background)
+    """
+
+    try:
+        entry = summaries.get(session_id) or {"summary": "", "last_folded": None}
+
+        summary = await llm_response_async(summary_prompt(entry["summary"], "\n".join(messages)))
+
+        summaries[session_id] = {"summary": summary, "last_folded": message_hash(messages[-1])}
+        history_stats["summaries_updated"] += 1
+
+    except Exception:
+        history_stats["summary_errors"] += 1
+
+    finally:
+        _updating.discard(session_id)
+
+
+def compact_history(session_id : str, history_list : list[str]) -> tuple[str, int]:
+
+    """
+    Builds the history string for the prompts within HISTORY_TOKEN_BUDGET.
+    Returns (history_str, tokens_saved) where tokens_saved is per prompt the history goes into.
+    """
+
+    full = "\n".join(history_list)
+    full_tokens = estimate_tokens(full)
+
+    history_stats["requests"] += 1
+    history_stats["tokens_full"] += full_tokens
+
+    # Short conversations go in as they are
+    if full_tokens <= HISTORY_TOKEN_BUDGET and len(history_list) <= 2 * HISTORY_VERBATIM_TURNS:
+        history_stats["tokens_sent"] += full_tokens
+        return full, 0
+
+    split = max(0, len(history_list) - 2 * HISTORY_VERBATIM_TURNS)
+    older, recent = history_list[:split], history_list[split:]
+
+    # Older turns the summary doesn't cover yet are folded in after this request
+    covered = covered_count(session_id, history_list)
+    if covered < len(older) and session_id not in _updating:
+        _updating.add(session_id)
+        task = asyncio.get_running_loop().create_task(update_summary(session_id, older[covered:]))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+    entry = summaries.get(session_id)
+    history_str = fit_to_budget(entry["summary"] if entry else "", recent, HISTORY_TOKEN_BUDGET)
+
+    sent_tokens = estimate_tokens(history_str)
+    history_stats["compacted"] += 1
+    history_stats["tokens_sent"] += sent_tokens
+
+    return history_str, max(0, full_tokens - sent_tokens)
+
+
+def get_history_stats() -> dict:
+
+    """
+    Gets how many prompt tokens the compaction saved
+    """
+
+    return {
+        **history_stats,
+        "tokens_saved": history_stats["tokens_full"] - history_stats["tokens_sent"],
+        "token_budget": HISTORY_TOKEN_BUDGET,
+        "verbatim_turns": HISTORY_VERBATIM_TURNS
+    }
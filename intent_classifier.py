@@ -0,0 +1,208 @@
+# Local fast-path intent classifier
+# Answers the obvious messages ("brochure for clarita", "hi", "report of buyers last month")
+# without an LLM round trip. Anything below the confidence threshold falls back to intent_prompt.
+
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, defaultdict
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+INTENTS = ["query", "conversation", "report", "brochure"]
+
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Labelled messages used for training, plus the log of messages the LLM labelled in production
+INTENT_CORPUS_PATH = os.getenv("INTENT_CORPUS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_corpus.jsonl"))
+INTENT_LOG_PATH = os.getenv("INTENT_LOG_PATH", "")
+
+
+# (label, pattern, confidence), checked in order, first match wins.
+# Data questions come first, "how many brochures do we have" is a query about brochures, not a request for one.
+# "list"/"show" directly followed by the thing itself ("show me a brochure for clarita") is still a request.
+RULES = [
+    ("query", re.compile(r"^(how many|how much|count|which|what is the (total|average|sum|number))\b"), 0.85),
+    ("query", re.compile(r"^(list|show)\b(?!( me)?( an?| the)? (broc?hu?r[a-z]*|reports?|excel|xlsx|spreadsheet|csv)\b)"), 0.85),
+    ("brochure", re.compile(r"\bbroc?hu?r[a-z]*"), 0.97),
+    ("report", re.compile(r"\b(excel|xlsx|spreadsheet|csv)\b"), 0.95),
+    ("report", re.compile(r"\breports?\b"), 0.9),
+    ("report", re.compile(r"\b(export|download)\b"), 0.85),
+    ("conversation", re.compile(r"^(hi|hello|hey|hiya|yo|thanks|thank you|thank you so much|thanks a lot|cheers|bye|goodbye|ok|okay|good (morning|afternoon|evening))( there)?\W*$"), 0.95),
+]
+
+TOKEN_RE = re.compile(r"[a-z0-9£]+")
+
+intent_stats = {
+    "fast_path": 0,
+    "llm_fallback": 0
+}
+
+_model = None
+_lock = threading.Lock()
+
+
+def tokenize(text : str) -> list[str]:
+
+    """
+    Lowercases and splits a message into word tokens
+    """
+    return TOKEN_RE.findall(text.lower())
+
+
+def load_labelled(path : str) -> list[tuple[str, str]]:
+
+    """
+    Loads (text, label) pairs from a JSON-lines file, skipping unknown labels
+    """
+
+    if not path or not os.path.exists(path):
+        return []
+
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            row = json.loads(line)
+            if row.get("label") in INTENTS:
+                pairs.append((row["text"], row["label"]))
+
+    return pairs
+
+
+def train(pairs : list[tuple[str, str]]) -> dict:
+
+    """
+    Trains a multinomial naive Bayes model (with Laplace smoothing) over the labelled messages
+    """
+
+    doc_counts = Counter()
+    token_counts = defaultdict(Counter)
+
+    for text, label in pairs:
+        doc_counts[label] += 1
+        token_counts[label].update(tokenize(text))
+
+    vocab = set()
+    for counts in token_counts.values():
+        vocab.update(counts)
+
+    total_docs = sum(doc_counts.values()) or 1
+
+    return {
+        "priors": {label: math.log((doc_counts[label] + 1) / (total_docs + len(INTENTS))) for label in INTENTS},
+        "counts": token_counts,
+        "totals": {label: sum(token_counts[label].values()) for label in INTENTS},
+        "vocab_size": len(vocab) or 1
+    }
+
+
+def get_model() -> dict:
+
+    """
+    Gets the trained model, training it on first use from the corpus and the intent log
+    """
+
+    global _model
+
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model = train(load_labelled(INTENT_CORPUS_PATH) + load_labelled(INTENT_LOG_PATH))
+
+    return _model
+
+
+def retrain():
+
+    """
+    Drops the model, the next classification retrains it (picks up newly logged labels)
+    """
+
+    global _model
+    _model = None
+
+
+def predict(text : str) -> tuple[str, float]:
+
+    """
+    Naive Bayes prediction, returns the best label and its posterior probability
+    """
+
+    model = get_model()
+    tokens = tokenize(text)
+
+    if not tokens:
+        return None, 0.0
+
+    scores = {}
+    for label in INTENTS:
+        counts = model["counts"][label]
+        denominator = model["totals"][label] + model["vocab_size"]
+
+        scores[label] = model["priors"][label] + sum(
+            math.log((counts[token] + 1) / denominator) for token in tokens
+        )
+
+    # softmax over the log scores
+    best = max(scores, key=scores.get)
+    norm = sum(math.exp(score - scores[best]) for score in scores.values())
+
+    return best, 1 / norm
+
+
+def classify_intent(user_input : str) -> tuple[str, float]:
+
+    """
+    Classifies the message locally, returns (intent, confidence).
+    Intent is None when nothing reaches INTENT_CONFIDENCE_THRESHOLD, the caller should ask the LLM then.
+    """
+
+    text = user_input.lower().strip()
+
+    for label, pattern, confidence in RULES:
+        if pattern.search(text):
+            break
+    else:
+        label, confidence = predict(text)
+
+    if label and confidence >= INTENT_CONFIDENCE_THRESHOLD:
+        intent_stats["fast_path"] += 1
+        return label, confidence
+
+    intent_stats["llm_fallback"] += 1
+    return None, confidence
+
+
+def log_labelled_intent(user_input : str, intent : str):
+
+    """
+    Appends an LLM-labelled message to INTENT_LOG_PATH (if set), for training on the next retrain
+    """
+
+    if not INTENT_LOG_PATH or intent not in INTENTS:
+        return
+
+    with open(INTENT_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"text": user_input, "label": intent}) + "\n")
+
+
+def get_intent_stats() -> dict:
+
+    """
+    Gets how many messages were answered locally vs sent to the LLM
+    """
+
+    total = intent_stats["fast_path"] + intent_stats["llm_fallback"]
+
+    return {
+        **intent_stats,
+        "llm_calls_saved_ratio": round(intent_stats["fast_path"] / total, 3) if total else 0.0
+    }
@@ -1,4 +1,7 @@
 import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -33,3 +36,125 @@ def llm_response(prompt : str):
     return response
 
 
+# Async variants, used by the async endpoints so an LLM call never blocks the event loop.
+# All of them share one semaphore (LLM_MAX_CONCURRENCY) to stay inside the Gemini quota under load,
+# time spent waiting on it is tracked separately from the model latency.
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+llm_stats = {
+    "calls": 0,
+    "errors": 0,
+    "waiting": 0,
+    "in_flight": 0,
+    "queue_wait_ms_total": 0.0,
+    "queue_wait_ms_max": 0.0,
+    "model_ms_total": 0.0,
+    "model_ms_max": 0.0
+}
+
+
+def _record(queue_wait : float, model : float, timings : dict = None):
+
+    """
+    Adds one finished call to the stats (and to the caller's timings dict, if given)
+    """
+
+    queue_wait_ms = queue_wait * 1000
+    model_ms = model * 1000
+
+    llm_stats["calls"] += 1
+    llm_stats["queue_wait_ms_total"] += queue_wait_ms
+    llm_stats["queue_wait_ms_max"] = max(llm_stats["queue_wait_ms_max"], queue_wait_ms)
+    llm_stats["model_ms_total"] += model_ms
+    llm_stats["model_ms_max"] = max(llm_stats["model_ms_max"], model_ms)
+
+    if timings is not None:
+        timings["queue_wait_ms"] = round(queue_wait_ms, 1)
+        timings["model_ms"] = round(model_ms, 1)
+
+
+@asynccontextmanager
+async def _llm_slot():
+
+    """
+    Waits for a free slot under the concurrency limit, yields the time spent waiting
+    """
+
+    llm_stats["waiting"] += 1
+    start = time.perf_counter()
+
+    try:
+        await llm_semaphore.acquire()
+    finally:
+        llm_stats["waiting"] -= 1
+
+    llm_stats["in_flight"] += 1
+
+    try:
+        yield time.perf_counter() - start
+    finally:
+        llm_stats["in_flight"] -= 1
+        llm_semaphore.release()
+
+
+async def llm_response_async(prompt : str, timings : dict = None) -> str:
+
+    """
+    Generates the response from llm and clean it, without blocking the event loop
+    """
+
+    async with _llm_slot() as queue_wait:
+
+        start = time.perf_counter()
+        try:
+            response = await llm.generate_content_async(prompt)
+        except Exception:
+            llm_stats["errors"] += 1
+            raise
+
+        _record(queue_wait, time.perf_counter() - start, timings)
+
+    return response.text.strip()
+
+
+async def llm_response_stream_async(prompt : str, timings : dict = None):
+
+    """
+    Streams the LLM output response chunk-by-chunk, without blocking the event loop.
+    The slot is held until the stream is finished.
+    """
+
+    async with _llm_slot() as queue_wait:
+
+        start = time.perf_counter()
+        try:
+            stream = await llm.generate_content_async(prompt, stream=True)
+
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+
+        except Exception:
+            llm_stats["errors"] += 1
+            raise
+
+        _record(queue_wait, time.perf_counter() - start, timings)
+
+
+def get_llm_stats() -> dict:
+
+    """
+    Gets the LLM call stats (queue wait and model latency kept apart)
+    """
+
+    calls = llm_stats["calls"] or 1
+
+    return {
+        **{key: round(value, 1) for key, value in llm_stats.items()},
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "queue_wait_ms_avg": round(llm_stats["queue_wait_ms_total"] / calls, 1),
+        "model_ms_avg": round(llm_stats["model_ms_total"] / calls, 1)
+    }
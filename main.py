@@ -8,14 +8,27 @@ from pydantic import BaseModel
 import mysql.connector
 
 # Loading Modules
-from db import fetch_schema, execute_query, get_connection
-from prompts import sql_prompt, llm_prompt, intent_prompt, build_where_clause_query
-from utils import cleaned_sql, is_safe_sql, parse_vague_time_phrases, clean_llm_json_response
-from llm import llm_response, llm_response_stream
-from memory import get_history, append_to_history, clear_history
+from async_db import run_db, run_db_cleanup, RequestConnectionMiddleware
+from db import get_statement_stats, get_pool_stats, check_ready, get_unit_stats, release_request_connection
+from prompts import llm_prompt, boat_name_prompt
+from utils import is_safe_sql
+from llm import llm_response_async, llm_response_stream_async, get_llm_stats
+from memory import get_history_async, append_to_history_async, get_memory_stats
+from history_manager import compact_history, get_history_stats
+from intent_classifier import get_intent_stats
+from planner import plan_request, get_planner_stats, get_speculation_stats
+from result_cache import cached_execute_query, get_result_cache_stats
+from result_render import render_result
+from sql_cache import store_sql, get_sql_cache_stats
 # from brochures import router as brochure_router
-from brochures import generate_brochure
-from reports import extract_filters_via_llm, generate_excel_report, sales_report_select_clause
+from brochures import generate_brochure, find_brochure_lead, get_brochure_cache_stats
+from boat_index import resolve_boat_name, get_boat_index_stats
+from brochure_batch import zip_brochures, start_prerender, get_prerender
+from reports import extract_filters_via_llm_async, stream_report, detect_report_format, REPORT_FORMATS
+from reports import file_chunks, REPORT_MEDIA_TYPES
+from report_query import compile_report_query, get_report_query_stats
+from report_jobs import submit_report_job, get_job, public_job, get_report_job_stats, REPORT_JOBS
+from render_pool import get_render_stats
 
 
 # FASTAPI initializing 
@@ -34,12 +47,18 @@ app.add_middleware(
 
 )
 
+# One lazily checked out DB connection per request, released once the response is sent
+app.add_middleware(RequestConnectionMiddleware)
+
 
 # Pydantic base model for two inputs
 class ChatRequest(BaseModel):
 
     session_id : str = 'admin'
     user_input : str
+    use_cache : bool = True
+    intent_mode : str | None = None
+    report_format : str | None = None
 
 
 # Root End point
@@ -52,6 +71,111 @@ def root():
     }
 
 
+# Metrics End Point
+@app.get("/metrics")
+def metrics():
+
+    return {
+        "llm": get_llm_stats(),
+        "intent": get_intent_stats(),
+        "sql_cache": get_sql_cache_stats(),
+        "report_query": get_report_query_stats(),
+        "report_jobs": get_report_job_stats(),
+        "render": get_render_stats(),
+        "brochure_cache": get_brochure_cache_stats(),
+        "boat_index": get_boat_index_stats(),
+        "statements": get_statement_stats(),
+        "db_pool": get_pool_stats(),
+        "request_scope": get_unit_stats(),
+        "result_cache": get_result_cache_stats(),
+        "planner": get_planner_stats(),
+        "speculation": get_speculation_stats(),
+        "memory": get_memory_stats(),
+        "history": get_history_stats()
+    }
+
+
+
+# Readiness End Point, 503 while the database can't be reached (or the pool has no connection to spare)
+@app.get("/ready")
+def ready():
+
+    state = check_ready()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
+# Report job status (and progress) End Point
+@app.get("/reports/{job_id}")
+def report_status(job_id : str):
+
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found (or expired)")
+
+    return public_job(job)
+
+
+# Report download End Point
+@app.get("/reports/{job_id}/download")
+def report_download(job_id : str):
+
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found (or expired)")
+
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {job['error']}")
+
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report is not ready yet ({job['status']}, {job['rows']} rows written)")
+
+    # Kept on disk until the job expires, so it can be downloaded again
+    return StreamingResponse(
+        file_chunks(job["path"], remove=False),
+        media_type=REPORT_MEDIA_TYPES[job["format"]],
+        headers={
+            "Content-Disposition": f"attachment; filename={job['report_type']}_report.{job['format']}",
+            "Content-Length": str(job["size"])
+        }
+    )
+
+
+# Brochure PDF End Point, revalidated with ETag / If-None-Match
+@app.get("/brochure/{boat_name}")
+async def brochure(boat_name : str, request : Request):
+
+    return await generate_brochure(boat_name.lower(), request.headers.get("if-none-match"))
+
+
+# All brochures in one ZIP, streamed while they are rendered (manifest.json at the end)
+@app.get("/brochures/archive")
+def brochures_archive(listed_only : bool = True):
+
+    return StreamingResponse(
+        zip_brochures(listed_only),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=brochures.zip"}
+    )
+
+
+# Pre-render all brochures into the cache in the background
+@app.post("/brochures/prerender")
+def brochures_prerender(listed_only : bool = True):
+
+    return start_prerender(listed_only)
+
+
+# Pre-render batch status (throughput and failed boats)
+@app.get("/brochures/prerender/{batch_id}")
+def brochures_prerender_status(batch_id : str):
+
+    batch = get_prerender(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return batch
+
+
 # Chat End Point
 @app.post("/chat")
 async def chat_endpoint(payload : ChatRequest):
@@ -69,23 +193,20 @@ async def chat_endpoint(payload : ChatRequest):
 
 
         # Getting the paramaters which we gonna pass to the Necessary functions
-        schema = fetch_schema()
-        history_list = get_history(session_id)
-        history_str = "\n".join(history_list)
-        clause_sale = sales_report_select_clause()
+        history_list = await get_history_async(session_id)
 
+        # Recent turns verbatim, older ones as a rolling summary, within the token budget
+        history_str, history_tokens_saved = compact_history(session_id, history_list)
 
-        # Lets calculate the intent of User's Message
-        intent = llm_response(intent_prompt(user_input)).lower().strip()
+
+        # Lets calculate the intent of User's Message (and what it needs next, see planner.py)
+        plan = await plan_request(user_input, history_list, history_str, mode=payload.intent_mode, use_cache=payload.use_cache)
+        intent = plan["intent"]
 
         # Chat handling after calculating the intent of User's Message
         if intent == "query":
 
-            # Detect vague time expressions like "last month", "this year"
-            time_context = parse_vague_time_phrases(user_input)
-
-            sql = llm_response(sql_prompt(user_input, schema, history_str, time_context))
-            sql = cleaned_sql(sql)
+            sql = plan["sql"]
 
             if not sql:
                 return {"Response": "I couldn't generate a valid SQL query. Please repharase." }
@@ -94,43 +215,52 @@ async def chat_endpoint(payload : ChatRequest):
             if not is_safe_sql(sql):
                 return {"Response": "Unsafe command detected ❌ Sorry, I'm not allowed to perform these type of tasks"}
             
-            result = execute_query(sql)
-            prompt = llm_prompt(user_input=user_input, query_result=result, history=history_str)
+            result = await run_db(cached_execute_query, sql, with_columns=True)
+
+            # Done with the database, don't hold the connection for the whole LLM stream
+            await run_db_cleanup(release_request_connection)
+
+            # Only SQL that actually ran goes into the cache
+            if plan["sql_key"] and not plan["sql_cached"] and not isinstance(result, str):
+                store_sql(plan["sql_key"], sql)
+
+            # Compact table for small results, sample + column aggregates for big ones
+            prompt = llm_prompt(user_input=user_input, query_result=render_result(result), history=history_str)
+
+            # History went into the answer prompt, and into the SQL prompt unless the SQL was cached
+            tokens_saved = history_tokens_saved * (1 if plan["sql_cached"] else 2)
 
             # Streaming Gemini response
-            def stream_gen():
+            async def stream_gen():
 
                 full_response = ""
-                for chunk in llm_response_stream(prompt):
+                async for chunk in llm_response_stream_async(prompt):
                     full_response += chunk
                     yield chunk
 
-                append_to_history(session_id, user_input, full_response)
+                await append_to_history_async(session_id, user_input, full_response)
 
-            return StreamingResponse(stream_gen(), media_type="text/plain")
+            return StreamingResponse(stream_gen(), media_type="text/plain", headers={"X-Prompt-Tokens-Saved": str(tokens_saved)})
 
         elif intent == "conversation":
 
-            def stream_gen():
+            async def stream_gen():
             
                 full_response = ""
-                for chunk in llm_response_stream(user_input):
+                async for chunk in llm_response_stream_async(user_input):
                     full_response += chunk
                     yield chunk
             
-                append_to_history(session_id, user_input, full_response)
+                await append_to_history_async(session_id, user_input, full_response)
 
             return StreamingResponse(stream_gen(), media_type="text/plain")
         
         elif intent == "report":
 
-            filters = extract_filters_via_llm(user_input)
+            filters = plan["filters"] or await extract_filters_via_llm_async(user_input)
 
-            prompt = build_where_clause_query(filters, clause_sale)
-            raw_llm_response = llm_response(prompt)
-            parsed = clean_llm_json_response(raw_llm_response)
-            query = parsed["query"]
-            params = parsed["params"]
+            # Filters -> parameterized SQL is compiled locally (report_query.py), no second LLM call
+            query, params = compile_report_query(filters)
 
 
 
@@ -140,62 +270,50 @@ async def chat_endpoint(payload : ChatRequest):
 
             # query = f"SELECT * FROM {table} {where_sql}"
 
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
+            # xlsx by default, csv / ndjson / parquet when asked for (in the payload or the message)
+            report_format = payload.report_format if payload.report_format in REPORT_FORMATS else detect_report_format(user_input)
 
-            cursor.execute(query, params)
-            result = cursor.fetchall()
+            # Big exports outlive a request, so the file is written by a background job and downloaded later
+            if REPORT_JOBS:
+                job = submit_report_job(query, params, filters.get("type"), report_format)
 
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
-                
+                return {
+                    "Response": "Your report is being generated, you can download it once it's ready.",
+                    **job,
+                    "status_url": f"/reports/{job['job_id']}",
+                    "download_url": f"/reports/{job['job_id']}/download"
+                }
 
-            return generate_excel_report(result, filters.get("type"))
+            # Rows go from the server-side cursor straight into the file, batch by batch
+            return await stream_report(query, params, filters.get("type"), report_format)
         
         elif intent == "brochure":
 
-            boat_name = llm_response(f"""You have given a user input, your job is to detect the name of boat from this input 
-                                     and return only its name, nothing else. 
+            # Boat name straight from the text with the boat index (typos included), the LLM only as a last resort
+            resolved = await run_db(resolve_boat_name, plan["boat_name"] or user_input)
+
+            # An index refresh may have checked out the request's connection, don't hold it while waiting on the LLM
+            await run_db_cleanup(release_request_connection)
 
-                                     For example:
+            if resolved["ambiguous"]:
+                return {
+                    "Response": "I found more than one boat that could match, which one do you mean?",
+                    "candidates": [candidate["name"] for candidate in resolved["candidates"]]
+                }
 
-                                     input: 'generate me a brochuer for alpha'
-                                     boat name: alpha
-                                     
-                                     input: 'generate a brochure for senorita'
-                                     boat name: senorita
-                                     
-                                     input: 'brochure for manaas'
-                                     boat name: manaas
-                                     
-                                     input: 'for clarita generate brochures'
-                                     boat name: clarita
+            boat_name = resolved["match"]
 
-                                     user input:
-                                     {user_input}
+            if boat_name is None:
+                llm_boat_name = (await llm_response_async(boat_name_prompt(user_input))).strip()
+                boat_name = (await run_db(resolve_boat_name, llm_boat_name))["match"] or llm_boat_name
 
-                                     """)
             boat_name = boat_name.lower()
 
             try:
-                conn = get_connection()
+                lead_id, brochure_avl = await run_db(find_brochure_lead, boat_name)
 
-                # Use separate cursors for separate queries
-                cursor1 = conn.cursor(dictionary=True)
-                cursor2 = conn.cursor(dictionary=True)
-
-                cursor1.execute("SELECT id FROM leads WHERE seller_boat_name = %s", (boat_name,))
-                result = cursor1.fetchone()
-
-                if not result:
+                if lead_id is None:
                     raise HTTPException(status_code=404, detail=f"There is no boat named in Database as: {boat_name}")
-                
-                lead_id = result['id']
-                
-                # Second query to check brochure availability
-                cursor2.execute("SELECT * FROM brochures WHERE name = %s", (boat_name,))
-                brochure_avl = cursor2.fetchone()
 
                 if not brochure_avl:
                     raise HTTPException(status_code=404, detail="Brochure data not found. Please fill it from the Admin panel")
@@ -206,12 +324,6 @@ async def chat_endpoint(payload : ChatRequest):
             except mysql.connector.Error as err:
                 raise HTTPException(status_code=500, detail=str(err))
 
-            finally:
-                if conn.is_connected():
-                    cursor1.close()
-                    cursor2.close()
-                    conn.close()            
-
 
             # return generate_brochure(boat_name)
         
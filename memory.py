@@ -1,43 +1,394 @@
 # Here will code for memory storage
 
-from collections import defaultdict
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", "3600"))
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "50"))
+MEMORY_MAX_SESSION_BYTES = int(os.getenv("MEMORY_MAX_SESSION_BYTES", str(64 * 1024)))
+
+# "memory" keeps history in this process only (single worker), "sqlite" shares it between workers
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")
+MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", "./session_memory.db")
+
+# Seconds a SQLite write waits for another worker's write before giving up (the history append is dropped then)
+MEMORY_SQLITE_BUSY_TIMEOUT = float(os.getenv("MEMORY_SQLITE_BUSY_TIMEOUT", "2"))
+
+# SQLite calls run here, off the event loop, so a write waiting on another worker doesn't freeze every request
+MEMORY_WORKERS = int(os.getenv("MEMORY_WORKERS", "4"))
+
+executor = ThreadPoolExecutor(max_workers=MEMORY_WORKERS, thread_name_prefix="memory")
 
 
 # session_memory = {
-#   "admin-123": ["...messages..."],
-#   "manager-456": ["...messages..."]
+#   "admin-123": {"messages": ["User ...", "Assistant ..."], "bytes": 1234, "last_seen": 1718000000.0},
+#   "manager-456": {...}
 # }
 
 
-session_memory = defaultdict(list)
+class MemoryBackend(ABC):
+
+    """
+    Interface of a session memory backend
+    """
+
+    @abstractmethod
+    def get(self, session_id : str) -> list[str]:
+        ...
+
+    @abstractmethod
+    def append(self, session_id : str, messages : list[str]):
+        ...
+
+    @abstractmethod
+    def clear(self, session_id : str):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class SessionStore(MemoryBackend):
+
+    """
+    Bounded session memory. Sessions are kept in LRU order and evicted when idle for longer than
+    idle_ttl or when there are more than max_sessions. Each session keeps at most max_turns turns
+    (one turn = user + assistant message) and max_bytes of text, dropping its oldest turns first.
+    """
+
+    def __init__(self, max_sessions : int, idle_ttl : float, max_turns : int, max_bytes : int):
+
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = {"lru": 0, "idle": 0, "turns_trimmed": 0}
+
+    def _expire_idle(self, now : float):
+
+        # Sessions are in LRU order, so the idle ones are all at the front
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session["last_seen"] < self.idle_ttl:
+                break
+
+            del self.sessions[session_id]
+            self.evicted["idle"] += 1
+
+    def get(self, session_id : str) -> list[str]:
+
+        now = time.time()
+
+        with self.lock:
+            self._expire_idle(now)
+
+            # Unknown sessions are not allocated until something is appended
+            session = self.sessions.get(session_id)
+            if session is None:
+                return []
+
+            session["last_seen"] = now
+            self.sessions.move_to_end(session_id)
+
+            return list(session["messages"])
+
+    def append(self, session_id : str, messages : list[str]):
+
+        now = time.time()
+
+        with self.lock:
+            self._expire_idle(now)
+
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = {"messages": [], "bytes": 0, "last_seen": now}
+
+            session["messages"].extend(messages)
+            session["bytes"] += sum(len(message.encode("utf-8")) for message in messages)
+            session["last_seen"] = now
+            self.sessions.move_to_end(session_id)
+
+            # Drop the oldest turns (two messages each) beyond the caps
+            while len(session["messages"]) > 2 * self.max_turns or (session["bytes"] > self.max_bytes and len(session["messages"]) > 2):
+                for dropped in session["messages"][:2]:
+                    session["bytes"] -= len(dropped.encode("utf-8"))
+                del session["messages"][:2]
+                self.evicted["turns_trimmed"] += 1
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted["lru"] += 1
+
+    def clear(self, session_id : str):
+
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+
+        with self.lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self.sessions),
+                "messages": sum(len(session["messages"]) for session in self.sessions.values()),
+                "bytes": sum(session["bytes"] for session in self.sessions.values()),
+                "max_sessions": self.max_sessions,
+                "evicted": dict(self.evicted)
+            }
+
+
+class SQLiteSessionStore(MemoryBackend):
+
+    """
+    Session memory shared by every worker process through one SQLite file in WAL mode.
+    Writes are append-only (clearing a session appends a marker row), a history is read in one query.
+    Every prune_every appends, sessions idle for longer than idle_ttl are deleted and active ones
+    are trimmed to their last max_turns turns.
+    """
+
+    def __init__(self, path : str, idle_ttl : float, max_turns : int, max_bytes : int, prune_every : int = 500,
+                 busy_timeout : float = 2.0):
+
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+
+        self.local = threading.local()
+        self.appends = 0
+        self.dropped = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_session_messages ON session_messages (session_id, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+
+        # sqlite3 connections can't be shared between threads, so one per thread
+        conn = getattr(self.local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+
+        return conn
+
+    def get(self, session_id : str) -> list[str]:
+
+        # Last max_turns turns after the latest clear marker (message IS NULL), oldest first
+        rows = self._conn().execute(
+            """
+            SELECT message FROM (
+                SELECT id, message FROM session_messages
+                WHERE session_id = ?
+                  AND id > COALESCE((SELECT MAX(id) FROM session_messages WHERE session_id = ? AND message IS NULL), 0)
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY id
+            """,
+            (session_id, session_id, 2 * self.max_turns)
+        ).fetchall()
+
+        messages = [row[0] for row in rows]
+
+        # Same byte cap as the in-process store, oldest turns go first
+        size = sum(len(message.encode("utf-8")) for message in messages)
+        while size > self.max_bytes and len(messages) > 2:
+            size -= sum(len(message.encode("utf-8")) for message in messages[:2])
+            del messages[:2]
+
+        return messages
+
+    def append(self, session_id : str, messages : list[str]):
+
+        now = time.time()
+        conn = self._conn()
+
+        try:
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO session_messages (session_id, message, created_at) VALUES (?, ?, ?)",
+                    [(session_id, message, now) for message in messages]
+                )
+
+        except sqlite3.OperationalError:
+            # Still locked after busy_timeout: losing one turn of history beats failing the answer
+            self.dropped += 1
+            return
+
+        self.appends += 1
+        if self.appends % self.prune_every == 0:
+            try:
+                self.prune()
+            except sqlite3.OperationalError:
+                pass
+
+    def clear(self, session_id : str):
+
+        with self._conn() as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT INTO session_messages (session_id, message, created_at) VALUES (?, NULL, ?)",
+                (session_id, time.time())
+            )
+
+    def prune(self):
+
+        """
+        Deletes sessions idle for longer than idle_ttl, everything before a clear marker,
+        and the rows of active sessions older than their newest 2 * max_turns (get never reads those)
+        """
+
+        cutoff = time.time() - self.idle_ttl
+
+        with self._conn() as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                """
+                DELETE FROM session_messages WHERE session_id IN (
+                    SELECT session_id FROM session_messages GROUP BY session_id HAVING MAX(created_at) < ?
+                )
+                """,
+                (cutoff,)
+            )
+            conn.execute(
+                """
+                DELETE FROM session_messages WHERE id <= (
+                    SELECT MAX(marker.id) FROM session_messages AS marker
+                    WHERE marker.session_id = session_messages.session_id AND marker.message IS NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                DELETE FROM session_messages WHERE id < (
+                    SELECT kept.id FROM session_messages AS kept
+                    WHERE kept.session_id = session_messages.session_id
+                    ORDER BY kept.id DESC
+                    LIMIT 1 OFFSET ?
+                )
+                """,
+                (2 * self.max_turns - 1,)
+            )
+
+    def stats(self) -> dict:
+
+        sessions, messages, size = self._conn().execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(message), COALESCE(SUM(LENGTH(CAST(message AS BLOB))), 0) FROM session_messages"
+        ).fetchone()
+
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "messages": messages,
+            "bytes": size,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "dropped_appends": self.dropped
+        }
+
+
+def create_backend() -> MemoryBackend:
+
+    """
+    Builds the session memory backend selected with MEMORY_BACKEND
+    """
+
+    if MEMORY_BACKEND == "sqlite":
+        return SQLiteSessionStore(MEMORY_SQLITE_PATH, MEMORY_IDLE_TTL, MEMORY_MAX_TURNS, MEMORY_MAX_SESSION_BYTES,
+                                  busy_timeout=MEMORY_SQLITE_BUSY_TIMEOUT)
+
+    return SessionStore(MEMORY_MAX_SESSIONS, MEMORY_IDLE_TTL, MEMORY_MAX_TURNS, MEMORY_MAX_SESSION_BYTES)
+
+
+session_memory = create_backend()
+
 
 def get_history(session_id : str) -> list[str]:
 
     """
     Gets the previous history (if available) using session ID
     """
-    return session_memory[session_id]
+    return session_memory.get(session_id)
 
 def append_to_history(session_id : str, user_msg : str, bot_msg : str):
-    
+
     """
     Add into the history after conversation
     """
-    session_memory[session_id].append(f"User {user_msg}")
-    session_memory[session_id].append(f"Assistant {bot_msg}")
+    session_memory.append(session_id, [f"User {user_msg}", f"Assistant {bot_msg}"])
 
 
-def clear_history(session_id : str):
-    
+async def run_memory(func, *args):
+
     """
-    Clears the memory history using session ID
+    Runs a session memory call without blocking the event loop. The in-process store answers
+    straight away, the SQLite one goes through the memory thread pool.
+    """
+
+    if not isinstance(session_memory, SQLiteSessionStore):
+        return func(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def get_history_async(session_id : str) -> list[str]:
+
+    """
+    get_history without blocking the event loop
     """
+    return await run_memory(get_history, session_id)
 
-    session_memory[session_id] = []
 
+async def append_to_history_async(session_id : str, user_msg : str, bot_msg : str):
 
+    """
+    append_to_history without blocking the event loop
+    """
+    return await run_memory(append_to_history, session_id, user_msg, bot_msg)
 
 
+def clear_history(session_id : str):
+
+    """
+    Clears the memory history using session ID
+    """
+
+    session_memory.clear(session_id)
 
 
+def get_memory_stats() -> dict:
+
+    """
+    Gets the memory usage of the session store
+    """
 
+    return session_memory.stats()
@@ -0,0 +1,270 @@
+# Request planning for the chat endpoint
+# Works out the intent of a message and whatever that intent needs next (SQL, report filters, boat name),
+# with as few LLM round trips as possible before the answer starts streaming.
+#
+# Modes (INTENT_MODE env, or intent_mode per request for A/B comparison):
+#   two_call  - intent_prompt first, then sql_prompt for query intents (the original flow)
+#   combined  - one combined_prompt returns the intent and its payload as JSON
+#   speculative - sql_prompt is started alongside intent_prompt, its result is kept only if the intent is query
+
+import os
+import re
+import time
+import asyncio
+from dotenv import load_dotenv
+
+from async_db import fetch_schema_async, run_db_cleanup
+from db import release_request_connection
+from schema_catalog import get_schema_version
+from schema_selector import relevant_schema
+from llm import llm_response_async
+from prompts import sql_prompt, intent_prompt, combined_prompt
+from utils import cleaned_sql, parse_vague_time_phrases, clean_llm_json_response
+from intent_classifier import INTENTS, classify_intent, log_labelled_intent
+from sql_cache import cache_key, get_cached_sql, history_is_relevant, record_bypass
+from reports import normalize_filters
+
+
+load_dotenv(override=True)
+
+INTENT_MODES = ["two_call", "combined", "speculative"]
+INTENT_MODE = os.getenv("INTENT_MODE", "two_call")
+
+planner_stats = {mode: {"requests": 0, "llm_calls": 0, "plan_ms_total": 0.0} for mode in INTENT_MODES}
+
+speculation_stats = {
+    "started": 0,
+    "committed": 0,
+    "wasted": 0,
+    "cancelled": 0,
+    "saved_ms_total": 0.0
+}
+
+
+async def classify_with_llm(user_input : str) -> str:
+
+    """
+    Asks the LLM for the intent label (and logs it for the local classifier)
+    """
+
+    intent = (await llm_response_async(intent_prompt(user_input))).lower().strip()
+    log_labelled_intent(user_input, intent)
+
+    return intent
+
+
+async def generate_sql(user_input : str, schema : str, history : str, time_context : dict) -> str:
+
+    """
+    Generates the SQL for a query intent, empty string if the LLM gave nothing usable
+    """
+
+    sql = await llm_response_async(sql_prompt(user_input, schema, history, time_context))
+    return cleaned_sql(sql)
+
+
+def sql_from_json(sql) -> str:
+
+    """
+    Gets the SQL out of the combined JSON answer (tolerates a ```sql fence around it)
+    """
+
+    if not sql:
+        return ""
+
+    match = re.search(r'```(?:sql)?\s*(.*?)\s*```', sql, re.DOTALL)
+    return (match.group(1) if match else sql).strip()
+
+
+async def combined_call(plan : dict, user_input : str, history : str) -> bool:
+
+    """
+    Fills the plan from one combined_prompt call, False if the answer couldn't be used
+    """
+
+    try:
+        parsed = clean_llm_json_response(
+            await llm_response_async(combined_prompt(user_input, plan["schema"], history, plan["time_context"]))
+        )
+    except ValueError:
+        return False
+
+    intent = str(parsed.get("intent") or "").lower().strip()
+    if intent not in INTENTS:
+        return False
+
+    plan["intent"] = intent
+    log_labelled_intent(user_input, intent)
+
+    if intent == "query":
+        plan["sql"] = sql_from_json(parsed.get("sql"))
+
+    elif intent == "report" and isinstance(parsed.get("filters"), dict):
+        plan["filters"] = normalize_filters(parsed["filters"])
+
+    elif intent == "brochure" and parsed.get("boat_name"):
+        plan["boat_name"] = str(parsed["boat_name"]).lower().strip()
+
+    return True
+
+
+async def plan_request(user_input : str, history_list : list[str], history : str, mode : str = None, use_cache : bool = True) -> dict:
+
+    """
+    Works out the intent and its payload. Returns the plan:
+    {"intent", "sql", "sql_key", "sql_cached", "filters", "boat_name", "schema", "time_context", "mode", "llm_calls"}
+    """
+
+    mode = mode if mode in INTENT_MODES else INTENT_MODE
+    start = time.perf_counter()
+
+    plan = {
+        "intent": None,
+        "sql": None,
+        "sql_key": None,
+        "sql_cached": False,
+        "filters": None,
+        "boat_name": None,
+        "schema": None,
+        "time_context": None,
+        "mode": mode,
+        "llm_calls": 0
+    }
+
+    # Obvious messages are classified locally
+    intent, _ = classify_intent(user_input)
+    plan["intent"] = intent
+
+    # Query (or unknown) intents need the schema, and maybe have their SQL cached already
+    if intent in (None, "query"):
+
+        # Detect vague time expressions like "last month", "this year"
+        plan["time_context"] = parse_vague_time_phrases(user_input)
+
+        # Schema comes from the in-process catalog, pruned to the tables this question needs
+        plan["schema"] = await fetch_schema_async()
+        if not plan["schema"].startswith("Error"):
+            # Follow-ups ("show their emails") also need the tables of the previous question
+            previous = [message[len("User "):] for message in history_list if message.startswith("User ")][-1:]
+            plan["schema"] = relevant_schema(" ".join([user_input] + previous) if history_is_relevant(user_input, history_list) else user_input)
+
+        # A catalog (re)load may have checked out the request's connection, don't hold it through the LLM calls
+        await run_db_cleanup(release_request_connection)
+
+        # Reuse SQL of an earlier identical question, unless it builds on the conversation
+        if use_cache and not plan["schema"].startswith("Error") and not history_is_relevant(user_input, history_list):
+            plan["sql_key"] = cache_key(user_input, plan["time_context"], get_schema_version())
+            plan["sql"] = get_cached_sql(plan["sql_key"])
+        else:
+            record_bypass()
+
+        # Only ever stored for query intents, so a hit settles the intent too
+        if plan["sql"] is not None:
+            plan["intent"] = "query"
+            plan["sql_cached"] = True
+
+    if plan["intent"] is None and mode == "combined":
+        plan["llm_calls"] += 1
+        await combined_call(plan, user_input, history)
+
+    if plan["intent"] is None and mode == "speculative":
+        plan["llm_calls"] += 2
+        await speculative_call(plan, user_input, history)
+
+    if plan["intent"] is None:
+        plan["llm_calls"] += 1
+        plan["intent"] = await classify_with_llm(user_input)
+
+    if plan["intent"] == "query" and not plan["sql"]:
+        plan["llm_calls"] += 1
+        plan["sql"] = await generate_sql(user_input, plan["schema"], history, plan["time_context"])
+
+    stats = planner_stats[mode]
+    stats["requests"] += 1
+    stats["llm_calls"] += plan["llm_calls"]
+    stats["plan_ms_total"] += (time.perf_counter() - start) * 1000
+
+    return plan
+
+
+async def speculative_call(plan : dict, user_input : str, history : str):
+
+    """
+    Runs the intent call and the SQL call at the same time.
+    The SQL is committed straight away for query intents, otherwise cancelled (or discarded if it already finished).
+    """
+
+    async def timed_sql():
+        start = time.perf_counter()
+        sql = await generate_sql(user_input, plan["schema"], history, plan["time_context"])
+        return sql, time.perf_counter() - start
+
+    speculation_stats["started"] += 1
+    sql_task = asyncio.create_task(timed_sql())
+
+    try:
+        intent_start = time.perf_counter()
+        plan["intent"] = await classify_with_llm(user_input)
+        intent_time = time.perf_counter() - intent_start
+
+    except BaseException:
+        sql_task.cancel()
+        raise
+
+    if plan["intent"] != "query":
+
+        if sql_task.done():
+            speculation_stats["wasted"] += 1
+
+            # Retrieve it so a failed call doesn't log "exception was never retrieved"
+            if not sql_task.cancelled():
+                sql_task.exception()
+        else:
+            speculation_stats["cancelled"] += 1
+            sql_task.cancel()
+
+        return
+
+    try:
+        sql, sql_time = await sql_task
+    except Exception:
+        # plan_request generates it again the usual way
+        speculation_stats["wasted"] += 1
+        return
+
+    plan["sql"] = sql
+
+    # Sequentially it would have been intent_time + sql_time, the overlap is what we saved
+    speculation_stats["committed"] += 1
+    speculation_stats["saved_ms_total"] += min(intent_time, sql_time) * 1000
+
+
+def get_speculation_stats() -> dict:
+
+    """
+    Gets wasted speculative SQL calls vs latency saved by the committed ones
+    """
+
+    return {
+        **speculation_stats,
+        "saved_ms_total": round(speculation_stats["saved_ms_total"], 1),
+        "saved_ms_avg": round(speculation_stats["saved_ms_total"] / speculation_stats["committed"], 1) if speculation_stats["committed"] else 0.0,
+        "waste_ratio": round((speculation_stats["wasted"] + speculation_stats["cancelled"]) / speculation_stats["started"], 3) if speculation_stats["started"] else 0.0
+    }
+
+
+def get_planner_stats() -> dict:
+
+    """
+    Gets per-mode planning stats, to compare the modes against each other
+    """
+
+    return {
+        mode: {
+            **stats,
+            "plan_ms_total": round(stats["plan_ms_total"], 1),
+            "plan_ms_avg": round(stats["plan_ms_total"] / stats["requests"], 1) if stats["requests"] else 0.0,
+            "llm_calls_avg": round(stats["llm_calls"] / stats["requests"], 2) if stats["requests"] else 0.0
+        }
+        for mode, stats in planner_stats.items()
+    }
@@ -23,16 +23,14 @@ If dates are relevant, use them in your WHERE clause.
 You are a helpful AI assistant for a Boat Brokers website.
 
 Your job is to convert the given user input into a valid, error-free SQL query based on the database schema provided.
-Return only the SQL query. Do not include explanations, comments, markdown, or code blocks. You have the whole database schema, so use it while writing sql query.
-You should be smart enough to understand whole database using this schema(provided below).
+Return only the SQL query. Do not include explanations, comments, markdown, or code blocks. You have the database schema of the tables relevant to this question, so use it while writing sql query.
+You should be smart enough to understand the database using this schema(provided below).
 You have previous messages history as CONVERSATION HISTORY, use that for the context of conversation. Maintain context throughout the whole conversation (first read CONVERSATION HISTORY then USER INPUT and SCHEMA)
 
 IMPORTANT NOTE: 
 - vendors or vendor are written 'seller' in database. So, when user asks for vendor make sure you replace vendor with seller
 - Data is mainly in the 'leads' table, all the buyers, sellers/vendors are present there, seperated by column 'type' (buyer/seller).
 - Sales Data is in 'deals' Table (if you cant find sales data in 'deals' then you can check 'leads' table)
-- Here is leads table structure: leads(id,type,source,facebook,instagram,linkedin,twitter,status,date,salutation_1,salutation_2,first_name_1,surname_1,first_name_2,surname_2,address_1,address_2,email_1,email_2,telephone_1,telephone_2,buyer_preference_boat,buyer_preference_stern_type,buyer_preference_length,buyer_preference_layout,buyer_budget,seller_boat_name,seller_boat_lying_at,seller_preference_boat,seller_boat_length,seller_preference_stern_type,seller_boat_year_built,seller_boat_builder,seller_boat_steel_spec,seller_boat_fit_out,seller_boat_no_of_berths,seller_boat_engin,seller_boat_last_service,seller_boat_blacking,seller_boat_anodes,seller_boat_safety_certificate,seller_boat_rcd_compliant,seller_boat_recent_survey,seller_boat_reason_for_sale,seller_valuation_low,seller_valuation_high,seller_commission_rate,seller_sale_price,is_archived,created_at,updated_at,note,buyer_preference_boat_name,won_at,listed,listed_at)
-- Here is deals table structure: deals(id,boat_seller_id,boat_buyer_id,status,survey,amendment,buyer_acceptance_letter,vendor_acceptance_letter,brokerage_offer_form_buyer,agreement_for_sale_purchase_both,bill_of_sale_seller,buyer_amendment_letter,vendor_amendment_letter,buyer_completion_letter,vendor_completion_letter,statement_of_account_seller,deposit,deposit_date,balance,balance_date,sale_price,sale_price_date,completed_at,canceled_at,commission,note,created_at,updated_at)
 NOTE: 
 - Vendors are known as sellers in database
 - Sales are known as deals in database
@@ -302,6 +300,145 @@ Now generate the query.
 
 
 
+def boat_name_prompt(user_input: str) -> str:
+    """
+    Few-shot prompt for LLM to pick the boat name out of a brochure request
+    """
+
+    prompt = f"""You have given a user input, your job is to detect the name of boat from this input 
+and return only its name, nothing else. 
+
+For example:
+
+input: 'generate me a brochuer for alpha'
+boat name: alpha
+
+input: 'generate a brochure for senorita'
+boat name: senorita
+
+input: 'brochure for manaas'
+boat name: manaas
+
+input: 'for clarita generate brochures'
+boat name: clarita
+
+user input:
+{user_input}
+
+"""
+
+    return prompt
+
+
+def combined_prompt(user_input: str, schema: str, history: str, time_context: dict = None) -> str:
+    """
+    Single prompt that classifies the intent and, in the same round trip, returns what that intent
+    needs next (SQL for query, filters for report, boat name for brochure) as one JSON object.
+    """
+
+    time_info = ""
+    if time_context:
+        time_info = f"""
+NOTE:
+Based on user's input, the following time context was detected:
+Start Date: {time_context['start_date']}
+End Date: {time_context['end_date']}
+
+If dates are relevant, use them in your WHERE clause / date_range.
+"""
+
+    prompt = f"""
+You are an intelligent assistant for a boat broker website called **THE BOAT BROKERS**.
+
+Step 1: classify the user input into **one of the following categories**:
+
+1. **query** - The user is asking for business-related data, often requiring database queries.
+   Examples: "Show me all buyers from last month", "How many leads came from California?", "List vendor emails"
+
+2. **conversation** - The user is engaging in casual or non-technical conversation.
+   Examples: "Hi, how are you?", "Can you help me?", "Thanks a lot!"
+
+3. **report** - The user wants to generate or download a report (usually in Excel format).
+   Look for words like: generate, download, create, excel, xlsx, report.
+   Examples: "Download a report of all vendors", "Generate buyer report in Excel"
+
+4. **brochure** - The user wants a brochure (PDF or summary document) for a vendor or seller.
+   Examples: "Generate a brochure for clarita", "brochure for manaas"
+
+Step 2: depending on the category, fill in the payload:
+
+- **query**: `sql` is a valid, error-free MySQL SELECT query for the user input, written from the DATABASE SCHEMA below.
+    - vendors or vendor are written 'seller' in database. So, when user asks for vendor make sure you replace vendor with seller
+    - Data is mainly in the 'leads' table, all the buyers, sellers/vendors are present there, seperated by column 'type' (buyer/seller).
+    - Sales Data is in 'deals' Table (if you cant find sales data in 'deals' then you can check 'leads' table)
+    - 'deals' table have column 'status' where contract received is reffered as 'contract_received' and cancelled is reffered as 'canceled'
+    - Use only the table and column names from the given schema.
+    - Use the CONVERSATION HISTORY for the context of follow-up questions.
+
+- **report**: `filters` is an object with:
+    - type: one of 'vendors', 'buyers', or 'sales' (synonyms: seller = vendors)
+    - status: for vendors/buyers one of 'all', 'new', 'won', 'archived'; for sales one of 'all', 'current', 'completed', 'cancelled'
+    - date_range: {{"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}}
+    - boat_type: one of 'narrow_boat', 'wide_beam', 'any'
+    - stern_type: one of 'cruiser', 'semi_traditional', 'traditional', 'euro_cruiser', 'other', 'any'
+    - budget: one of 'Under £25K', '£25k-50k', '£50k-75k', '£75k-£100k', '£100k+', 'All' (only for buyers/sales)
+    - layout: one of 'traditional', 'reverse', 'engine_room', 'any' (only for buyers/sales)
+    If a filter is not specified in the message, set its value to null.
+
+- **brochure**: `boat_name` is the name of the boat only (e.g. 'brochure for manaas' -> "manaas").
+
+- **conversation**: no payload.
+
+Respond **only** with a JSON object, keys that don't apply to the category are null:
+
+{{
+  "intent": "query" | "conversation" | "report" | "brochure",
+  "sql": "SELECT ..." | null,
+  "filters": {{...}} | null,
+  "boat_name": "..." | null
+}}
+
+
+CONVERSATION HISTORY:
+{history}
+
+USER INPUT:
+{user_input}
+
+{time_info}
+
+DATABASE SCHEMA:
+{schema}
+"""
+
+    return prompt
+
+
+
+def summary_prompt(previous_summary: str, messages: str) -> str:
+    """
+    Prompt for LLM to fold older conversation turns into the rolling summary of a session
+    """
+
+    prompt = f"""
+You are summarizing a conversation between an admin of THE BOAT BROKERS website and its AI assistant.
+The summary is given to the assistant instead of the old messages, so keep everything needed to
+understand follow-up questions: which buyers, sellers/vendors, boats, deals, dates, filters and numbers
+were talked about, and what the admin was trying to find out.
+
+Update the CURRENT SUMMARY with the NEW MESSAGES. Be short and factual, at most 10 lines, no preamble.
+
+CURRENT SUMMARY:
+{previous_summary or "(empty)"}
+
+NEW MESSAGES:
+{messages}
+"""
+
+    return prompt
+
+
+
 # from reports import extract_filters_via_llm
 # from llm import llm_response
 
@@ -0,0 +1,256 @@
+# Process pool for CPU-bound rendering (xlsx reports, brochure PDFs)
+# xlsxwriter and FPDF are pure Python, so rendering in a thread still holds the GIL and stalls every
+# chat stream of the worker. Rendering runs in separate processes instead, at most RENDER_MAX_CONCURRENCY
+# at a time, each with a timeout. Render functions get plain rows/dicts (or a spooled rows file), never a
+# DB connection, and must be top-level functions so they can be pickled.
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_MAX_CONCURRENCY = int(os.getenv("RENDER_MAX_CONCURRENCY", str(RENDER_WORKERS)))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "300"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(RENDER_MAX_CONCURRENCY)
+_stats_lock = threading.Lock()
+
+_END = object()
+
+render_stats = {
+    "queued": 0,
+    "running": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "render_ms_total": 0.0,
+    "render_ms_max": 0.0
+}
+
+
+def get_pool() -> ProcessPoolExecutor:
+
+    """
+    Gets the render process pool, started on first use.
+    Workers are spawned (not forked) so they don't inherit the server's threads and sockets.
+    """
+
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+    return _pool
+
+
+def reset_pool(pool : ProcessPoolExecutor = None, kill : bool = False):
+
+    """
+    Drops the pool (broken, or with a hung worker), a new one is started on the next render.
+    Given pool, only that one: a pool replaced meanwhile by a fresh one is left alone.
+    With kill its workers are terminated too: a timed out render can't be interrupted otherwise,
+    and it would keep its slot (and its worker) for as long as it hangs.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        pool = pool or _pool
+        if _pool is pool:
+            _pool = None
+
+    if pool is None:
+        return
+
+    if kill:
+        # No public way to stop a running job, the futures of killed workers fail with BrokenProcessPool
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _count(key : str, delta : int = 1):
+
+    with _stats_lock:
+        render_stats[key] += delta
+
+
+def _submit(func, *args):
+
+    """
+    Submits a job to the pool, the caller holds a slot. The slot is released (and the job counted)
+    when the job really ends: a process can't be interrupted, so a timed out job keeps its slot until then.
+    """
+
+    start = time.perf_counter()
+    _count("running")
+
+    try:
+        pool = get_pool()
+        future = pool.submit(func, *args)
+
+    except Exception as e:
+        # Broken pool, or one shut down by a concurrent reset_pool (RuntimeError)
+        _count("running", -1)
+        _slots.release()
+        if isinstance(e, BrokenProcessPool):
+            reset_pool(pool)
+        raise
+
+    # The pool to reset if this job hangs or breaks it
+    future.render_pool = pool
+
+    def done(future):
+        elapsed = (time.perf_counter() - start) * 1000
+        failed = future.cancelled() or future.exception() is not None
+
+        with _stats_lock:
+            render_stats["running"] -= 1
+            render_stats["failed" if failed else "completed"] += 1
+            render_stats["render_ms_total"] += elapsed
+            render_stats["render_ms_max"] = max(render_stats["render_ms_max"], elapsed)
+
+        _slots.release()
+
+    future.add_done_callback(done)
+    return future
+
+
+def render_sync(func, *args, timeout : float = None):
+
+    """
+    Runs func(*args) in the render pool and waits for its result (blocking).
+    Raises TimeoutError if it takes longer than timeout (RENDER_TIMEOUT by default),
+    the pool is recycled then (other renders running in it fail too).
+    """
+
+    timeout = timeout or RENDER_TIMEOUT
+
+    _count("queued")
+    _slots.acquire()
+    _count("queued", -1)
+
+    future = _submit(func, *args)
+
+    try:
+        return future.result(timeout=timeout)
+
+    except TimeoutError:
+        _count("timeouts")
+        reset_pool(future.render_pool, kill=True)
+        raise TimeoutError(f"Rendering took longer than {timeout:g}s")
+
+    except BrokenProcessPool:
+        # A worker died (killed, out of memory), the next render starts a fresh pool
+        reset_pool(future.render_pool)
+        raise
+
+
+def render_map(func, items, timeout : float = None):
+
+    """
+    Runs func(item) for every item across the pool, at most RENDER_MAX_CONCURRENCY at a time (blocking).
+    Yields (item, result, error) as the jobs finish, error is None on success.
+    A failing item doesn't stop the others. A timed out one recycles the pool, the items running
+    alongside it fail with BrokenProcessPool.
+    """
+
+    timeout = timeout or RENDER_TIMEOUT
+    items = iter(items)
+    pending = {}
+    exhausted = False
+
+    while pending or not exhausted:
+
+        # Keep the pool busy while there are items left
+        while not exhausted and len(pending) < RENDER_MAX_CONCURRENCY:
+            item = next(items, _END)
+            if item is _END:
+                exhausted = True
+                break
+
+            _count("queued")
+            _slots.acquire()
+            _count("queued", -1)
+
+            try:
+                pending[_submit(func, item)] = (item, time.monotonic() + timeout)
+            except Exception as e:
+                yield item, None, e
+
+        if not pending:
+            continue
+
+        next_deadline = min(deadline for _, deadline in pending.values())
+        done, _ = wait(pending, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            item, _ = pending.pop(future)
+
+            if future.cancelled():
+                yield item, None, BrokenProcessPool("Render job was cancelled")
+                continue
+
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                reset_pool(future.render_pool)
+
+            yield item, None if error else future.result(), error
+
+        now = time.monotonic()
+        timed_out = [(future, item) for future, (item, deadline) in pending.items() if deadline <= now and not future.done()]
+
+        for future, item in timed_out:
+            del pending[future]
+            _count("timeouts")
+
+            # Hung workers would hold their slots for good
+            reset_pool(future.render_pool, kill=True)
+
+        for future, item in timed_out:
+            yield item, None, TimeoutError(f"Rendering took longer than {timeout:g}s")
+
+
+async def render_async(func, *args, timeout : float = None):
+
+    """
+    Async version of render_sync, the waiting happens off the event loop
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(render_sync, func, *args, timeout=timeout))
+
+
+def get_render_stats() -> dict:
+
+    """
+    Gets the render queue depth and render times
+    """
+
+    with _stats_lock:
+        stats = dict(render_stats)
+
+    finished = stats["completed"] + stats["failed"]
+
+    return {
+        **stats,
+        "render_ms_total": round(stats["render_ms_total"], 1),
+        "render_ms_max": round(stats["render_ms_max"], 1),
+        "render_ms_avg": round(stats["render_ms_total"] / finished, 1) if finished else 0.0,
+        "workers": RENDER_WORKERS,
+        "max_concurrency": RENDER_MAX_CONCURRENCY
+    }
@@ -0,0 +1,388 @@
+# Background report jobs
+# Big exports don't run inside the /chat request anymore: the report intent submits a job and gets its id
+# straight back, a small worker pool runs the query and writes the file, and the client polls the status
+# and downloads the file when it's done. Finished files are kept for REPORT_JOB_TTL seconds.
+# Submitting a report identical to one still queued/running returns the job already in flight.
+# Job state lives next to the files in REPORT_JOB_DIR ({id}.json), so every worker process of the host
+# sees every job, and duplicates are caught across workers with an in-flight marker file per report.
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from reports import write_report
+
+
+load_dotenv(override=True)
+
+# "true" runs reports as background jobs, "false" streams them inside the /chat request
+REPORT_JOBS = os.getenv("REPORT_JOBS", "true").lower() == "true"
+
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_TTL = float(os.getenv("REPORT_JOB_TTL", "3600"))
+REPORT_JOB_DIR = os.getenv("REPORT_JOB_DIR", os.path.join(tempfile.gettempdir(), "report_jobs"))
+
+# Expired jobs (and jobs of workers that died) are swept this often, and once when the worker starts
+REPORT_JOB_SWEEP_SECONDS = float(os.getenv("REPORT_JOB_SWEEP_SECONDS", "60"))
+
+# Progress is written to the job file at most this often
+REPORT_JOB_PROGRESS_SECONDS = 1.0
+
+# Each worker holds one pool connection while its query runs, so keep it well below the pool size.
+# Job threads don't copy the submitting request's context, a job outlives the request.
+executor = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix="report")
+
+# Jobs run by this process, the job files are the state every process reads
+_jobs = {}
+_lock = threading.Lock()
+_sweeper = None
+
+job_stats = {
+    "submitted": 0,
+    "deduplicated": 0,
+    "done": 0,
+    "failed": 0,
+    "expired": 0
+}
+
+
+# {REPORT_JOB_DIR}/9f1c....json = {"id": "9f1c...", "status": "running", "report_type": "buyer", "format": "xlsx",
+#     "rows": 12000, "size": None, "path": "/tmp/report_jobs/9f1c....xlsx", "error": None, "pid": 4242,
+#     "created_at": ..., "started_at": ..., "finished_at": None, "expires_at": None, "key": "..."}
+# {REPORT_JOB_DIR}/inflight-<key>  = id of the queued/running job for that report
+
+
+def job_key(query : str, params, report_format : str) -> str:
+
+    """
+    Identifies identical report requests (same SQL, params and format)
+    """
+
+    return hashlib.sha1(repr((query, list(params or []), report_format)).encode("utf-8")).hexdigest()
+
+
+def job_file(job_id : str) -> str:
+    return os.path.join(REPORT_JOB_DIR, f"{job_id}.json")
+
+
+def marker_file(key : str) -> str:
+    return os.path.join(REPORT_JOB_DIR, f"inflight-{key}")
+
+
+def remove_file(path : str):
+
+    try:
+        if path:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def save_job(job : dict):
+
+    """
+    Writes the job file, atomically so other workers never read half of it
+    """
+
+    tmp = f"{job_file(job['id'])}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+
+    os.replace(tmp, job_file(job["id"]))
+
+
+def load_job(job_id : str) -> dict | None:
+
+    """
+    Reads a job file, None if there's no such job
+    """
+
+    # Ids are uuid4 hex, anything else never names a job file (and can't walk out of REPORT_JOB_DIR)
+    if not job_id or len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id):
+        return None
+
+    try:
+        with open(job_file(job_id), encoding="utf-8") as f:
+            return json.load(f)
+
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def owner_alive(job : dict) -> bool:
+
+    """
+    Whether the worker process running the job is still there
+    """
+
+    if job.get("pid") == os.getpid():
+        return True
+
+    try:
+        os.kill(job["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, KeyError, TypeError):
+        pass
+
+    return True
+
+
+def finish_job(job : dict, status : str, error : str = None):
+
+    """
+    Marks a job done/failed, starts its expiry and frees its report for new submissions
+    """
+
+    now = time.time()
+    job.update({"status": status, "error": error, "finished_at": now, "expires_at": now + REPORT_JOB_TTL})
+    save_job(job)
+
+    try:
+        with open(marker_file(job["key"]), encoding="utf-8") as f:
+            if f.read().strip() == job["id"]:
+                remove_file(marker_file(job["key"]))
+    except FileNotFoundError:
+        pass
+
+
+def expire_jobs(now : float = None):
+
+    """
+    Drops finished jobs past their expiry, with their files.
+    Jobs left queued/running by a worker that died are failed (and expire later).
+    """
+
+    now = now or time.time()
+
+    if not os.path.isdir(REPORT_JOB_DIR):
+        return
+
+    for name in os.listdir(REPORT_JOB_DIR):
+        if not name.endswith(".json"):
+            continue
+
+        job = load_job(name[:-len(".json")])
+        if job is None:
+            continue
+
+        if job["expires_at"] and job["expires_at"] <= now:
+            remove_file(job["path"])
+            remove_file(job_file(job["id"]))
+            job_stats["expired"] += 1
+
+        elif job["status"] in ("queued", "running") and not owner_alive(job):
+            remove_file(job["path"])
+            finish_job(job, "failed", "The worker running this report stopped")
+
+    with _lock:
+        for job_id in [job_id for job_id, job in _jobs.items() if job["expires_at"] and job["expires_at"] <= now]:
+            del _jobs[job_id]
+
+
+def sweep_forever():
+
+    while True:
+        try:
+            expire_jobs()
+        except Exception:
+            pass
+
+        time.sleep(REPORT_JOB_SWEEP_SECONDS)
+
+
+def start_sweeper():
+
+    """
+    Starts the background sweep of expired jobs (once per process, when the module is loaded)
+    """
+
+    global _sweeper
+
+    with _lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=sweep_forever, name="report-sweeper", daemon=True)
+            _sweeper.start()
+
+
+def run_job(job : dict, query : str, params):
+
+    """
+    Runs one report job in a worker thread
+    """
+
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    save_job(job)
+
+    saved_at = time.monotonic()
+
+    def progress(rows):
+        nonlocal saved_at
+        job["rows"] = rows
+
+        if time.monotonic() - saved_at >= REPORT_JOB_PROGRESS_SECONDS:
+            saved_at = time.monotonic()
+            save_job(job)
+
+    try:
+        job["rows"] = write_report(query, params, job["report_type"], job["format"], job["path"], progress)
+        job["size"] = os.path.getsize(job["path"])
+        status, error = "done", None
+
+    except Exception as e:
+        remove_file(job["path"])
+        status, error = "failed", str(e)
+
+    with _lock:
+        job_stats[status] += 1
+
+    finish_job(job, status, error)
+
+
+def claim_report(key : str, job_id : str) -> str | None:
+
+    """
+    Registers job_id as the in-flight job of a report. Returns the id of the job already in flight
+    (in any worker) instead, None when job_id got it.
+    """
+
+    for _ in range(3):
+        try:
+            fd = os.open(marker_file(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+
+        except FileExistsError:
+            try:
+                with open(marker_file(key), encoding="utf-8") as f:
+                    other = load_job(f.read().strip())
+            except FileNotFoundError:
+                continue
+
+            if other and other["status"] in ("queued", "running") and owner_alive(other):
+                return other["id"]
+
+            # Left behind by a finished job or a dead worker
+            remove_file(marker_file(key))
+            continue
+
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(job_id)
+
+        return None
+
+    # Lost every race, run it anyway rather than fail the request
+    return None
+
+
+def submit_report_job(query : str, params, report_type : str, report_format : str = "xlsx") -> dict:
+
+    """
+    Queues a report and returns its job (or the identical job already in flight)
+    """
+
+    os.makedirs(REPORT_JOB_DIR, exist_ok=True)
+
+    key = job_key(query, params, report_format)
+    job_id = uuid.uuid4().hex
+
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "report_type": report_type,
+        "format": report_format,
+        "rows": 0,
+        "size": None,
+        "path": os.path.join(REPORT_JOB_DIR, f"{job_id}.{report_format}"),
+        "error": None,
+        "pid": os.getpid(),
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "expires_at": None,
+        "key": key
+    }
+
+    # The job file goes first, a worker finding the marker can always read the job
+    save_job(job)
+    other_id = claim_report(key, job_id)
+
+    if other_id:
+        remove_file(job_file(job_id))
+        other = load_job(other_id)
+
+        if other:
+            with _lock:
+                job_stats["deduplicated"] += 1
+            return public_job(other)
+
+    with _lock:
+        _jobs[job_id] = job
+        job_stats["submitted"] += 1
+
+    executor.submit(run_job, job, query, params)
+
+    return public_job(job)
+
+
+def public_job(job : dict) -> dict:
+
+    """
+    The job fields that are safe to hand out (no file path or dedup key)
+    """
+
+    now = time.time()
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "report_type": job["report_type"],
+        "format": job["format"],
+        "rows_written": job["rows"],
+        "size": job["size"],
+        "error": job["error"],
+        "elapsed_seconds": round((job["finished_at"] or now) - job["started_at"], 2) if job["started_at"] else 0.0,
+        "expires_in_seconds": round(job["expires_at"] - now) if job["expires_at"] else None
+    }
+
+
+def get_job(job_id : str) -> dict | None:
+
+    """
+    Gets a job by id (run by any worker), None if it doesn't exist (or has expired)
+    """
+
+    job = _jobs.get(job_id)
+    job = dict(job) if job else load_job(job_id)
+
+    if job is None or (job["expires_at"] and job["expires_at"] <= time.time()):
+        return None
+
+    return job
+
+
+def get_report_job_stats() -> dict:
+
+    """
+    Gets the job queue stats (of this worker)
+    """
+
+    with _lock:
+        statuses = [job["status"] for job in _jobs.values()]
+
+    return {
+        **job_stats,
+        "queued": statuses.count("queued"),
+        "running": statuses.count("running"),
+        "retained": statuses.count("done"),
+        "workers": REPORT_JOB_WORKERS
+    }
+
+
+start_sweeper()
@@ -0,0 +1,182 @@
+# Report query compiler
+# Turns the normalized report filters (type, status, date_range, boat_type, stern_type, budget, layout)
+# into parameterized SQL locally, so reports need no second LLM round trip and the same filters
+# always give the same SQL. The SQL template only depends on which filters are set (the filter shape),
+# so templates are compiled once per shape and cached, the values only ever go into the params.
+
+from datetime import date, timedelta
+from functools import lru_cache
+
+from reports import sales_report_select_clause
+
+
+REPORT_TYPES = ["buyer", "seller", "deals"]
+
+# Values meaning "no filter"
+IGNORED_VALUES = {"", "all", "any", "none", "null"}
+
+# Filter -> column(s) per report type. A filter with more than one column matches if any of them does.
+FIELD_COLUMNS = {
+    "buyer": {
+        "status": ["status"],
+        "boat_type": ["buyer_preference_boat"],
+        "stern_type": ["buyer_preference_stern_type"],
+        "budget": ["buyer_budget"],
+        "layout": ["buyer_preference_layout"]
+    },
+    "seller": {
+        "status": ["status"],
+        "boat_type": ["seller_preference_boat"],
+        "stern_type": ["seller_preference_stern_type"]
+    },
+    "deals": {
+        "status": ["deals.status"],
+        "boat_type": ["buyer_lead.buyer_preference_boat", "seller_lead.seller_preference_boat"],
+        "stern_type": ["buyer_lead.buyer_preference_stern_type", "seller_lead.seller_preference_stern_type"],
+        "budget": ["buyer_lead.buyer_budget"],
+        "layout": ["buyer_lead.buyer_preference_layout"]
+    }
+}
+
+DATE_COLUMNS = {
+    "buyer": "created_at",
+    "seller": "created_at",
+    "deals": "deals.created_at"
+}
+
+# The filter prompt says 'cancelled', the deals table says 'canceled'
+STATUS_VALUES = {
+    "deals": {"cancelled": "canceled"}
+}
+
+DEALS_FROM_CLAUSE = """
+FROM deals
+JOIN boat_buyers ON deals.boat_buyer_id = boat_buyers.id
+JOIN boat_sellers ON deals.boat_seller_id = boat_sellers.id
+JOIN leads AS buyer_lead ON boat_buyers.lead_id = buyer_lead.id
+JOIN leads AS seller_lead ON boat_sellers.lead_id = seller_lead.id
+"""
+
+
+def filter_value(value):
+
+    """
+    The filter value, or None if it means no filter
+    """
+
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    if value.lower() in IGNORED_VALUES:
+        return None
+
+    return value
+
+
+def parse_date_range(date_range) -> tuple[date, date] | None:
+
+    """
+    (start, end) of a {"start_date", "end_date"} filter, None if it isn't complete.
+    Raises ValueError for dates that aren't YYYY-MM-DD.
+    """
+
+    if not isinstance(date_range, dict) or not date_range.get("start_date") or not date_range.get("end_date"):
+        return None
+
+    try:
+        return date.fromisoformat(str(date_range["start_date"])), date.fromisoformat(str(date_range["end_date"]))
+    except ValueError:
+        raise ValueError(f"Invalid report date range: {date_range}")
+
+
+def filter_shape(filters : dict) -> tuple[str, tuple, bool]:
+
+    """
+    The part of the filters the SQL depends on: report type, which filters are set and whether there is a date range
+    """
+
+    report_type = filters.get("type")
+    if report_type not in REPORT_TYPES:
+        raise ValueError(f"Unknown report type: {report_type!r}, expected one of {', '.join(REPORT_TYPES)}")
+
+    fields = tuple(field for field in FIELD_COLUMNS[report_type] if filter_value(filters.get(field)) is not None)
+
+    return report_type, fields, parse_date_range(filters.get("date_range")) is not None
+
+
+@lru_cache(maxsize=256)
+def compile_template(report_type : str, fields : tuple, has_date_range : bool) -> str:
+
+    """
+    Builds the SQL template of one filter shape, the params go in the same order as the placeholders
+    """
+
+    where = []
+
+    if report_type == "deals":
+        base = sales_report_select_clause() + DEALS_FROM_CLAUSE
+    else:
+        base = "SELECT * FROM leads\n"
+        where.append("type = %s")
+
+    for field in fields:
+        columns = FIELD_COLUMNS[report_type][field]
+        condition = " OR ".join(f"{column} = %s" for column in columns)
+        where.append(f"({condition})" if len(columns) > 1 else condition)
+
+    # Whole end day included, and still usable with an index on created_at
+    if has_date_range:
+        date_column = DATE_COLUMNS[report_type]
+        where.append(f"{date_column} >= %s AND {date_column} < %s")
+
+    where_sql = "WHERE " + "\n  AND ".join(where) + "\n" if where else ""
+
+    return f"{base}{where_sql}ORDER BY {DATE_COLUMNS[report_type]} ASC"
+
+
+def compile_report_query(filters : dict) -> tuple[str, list]:
+
+    """
+    Compiles normalized report filters into (query, params), ready for the report writers.
+    Raises ValueError for an unknown report type or a malformed date range.
+    """
+
+    report_type, fields, has_date_range = filter_shape(filters)
+    query = compile_template(report_type, fields, has_date_range)
+
+    params = []
+
+    if report_type != "deals":
+        params.append(report_type)
+
+    for field in fields:
+        value = filter_value(filters[field])
+
+        if field == "status":
+            value = value.lower()
+            value = STATUS_VALUES.get(report_type, {}).get(value, value)
+
+        params.extend([value] * len(FIELD_COLUMNS[report_type][field]))
+
+    if has_date_range:
+        start, end = parse_date_range(filters["date_range"])
+        params.extend([start.isoformat(), (end + timedelta(days=1)).isoformat()])
+
+    return query, params
+
+
+def get_report_query_stats() -> dict:
+
+    """
+    Gets the compiled template cache stats
+    """
+
+    info = compile_template.cache_info()
+
+    return {
+        "templates": info.currsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "max_templates": info.maxsize
+    }
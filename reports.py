@@ -1,15 +1,40 @@
 # Report related Functions and routing here
 # report.py
-import pandas as pd
-from io import BytesIO
+import os
+import csv
+import pickle
+import tempfile
+from io import StringIO
+from datetime import date, datetime
+import base64
+from decimal import Decimal, ROUND_HALF_EVEN
+import xlsxwriter
+from mysql.connector.constants import FieldType
 from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+from db import QueryStream
+from async_db import run_db, run_db_cleanup, open_stream_async, stream_batches_async
+from render_pool import render_sync, render_async
 from utils import parse_vague_time_phrases
-from llm import llm_response
+from llm import llm_response, llm_response_async
 from prompts import build_filter_extraction_prompt, build_where_clause_query
 import json
 import re
 
 
+load_dotenv(override=True)
+
+# Column widths are estimated from this many rows, not the whole report
+REPORT_WIDTH_SAMPLE_ROWS = int(os.getenv("REPORT_WIDTH_SAMPLE_ROWS", "500"))
+REPORT_MAX_COLUMN_WIDTH = int(os.getenv("REPORT_MAX_COLUMN_WIDTH", "60"))
+
+# Rows per Parquet row group (= rows per fetchmany while writing it)
+REPORT_PARQUET_ROW_GROUP = int(os.getenv("REPORT_PARQUET_ROW_GROUP", "50000"))
+
+# Scale of DECIMAL columns in Parquet (the driver doesn't report the column's own), precision is always 38
+REPORT_PARQUET_DECIMAL_SCALE = int(os.getenv("REPORT_PARQUET_DECIMAL_SCALE", "10"))
+
+
 def sales_report_select_clause():
     
     """
@@ -92,6 +117,27 @@ def extract_filters_via_llm(user_message: str) -> dict:
     prompt = build_filter_extraction_prompt(user_message, time_context)
     response = llm_response(prompt)
 
+    return parse_filters(response)
+
+
+async def extract_filters_via_llm_async(user_message: str) -> dict:
+    """
+    Async version of extract_filters_via_llm, for the async chat endpoint
+    """
+
+    time_context = parse_vague_time_phrases(user_message)
+
+    prompt = build_filter_extraction_prompt(user_message, time_context)
+    response = await llm_response_async(prompt)
+
+    return parse_filters(response)
+
+
+def parse_filters(response: str) -> dict:
+    """
+    Parses the filters JSON out of the LLM response and normalizes the report type
+    """
+
     match = re.search(r'\{.*\}', response, re.DOTALL)
     if not match:
         raise ValueError("Could not extract JSON from LLM response.")
@@ -103,6 +149,14 @@ def extract_filters_via_llm(user_message: str) -> dict:
     except json.JSONDecodeError as e:
         raise ValueError(f"Invalid JSON extracted: {e}")
 
+    return normalize_filters(filters)
+
+
+def normalize_filters(filters: dict) -> dict:
+    """
+    Normalizes the report type of extracted filters to the database naming (seller/buyer/deals)
+    """
+
     # Normalize type
     type_map = {
         "vendors": "seller",
@@ -116,7 +170,7 @@ def extract_filters_via_llm(user_message: str) -> dict:
         "deals": "deals"
     }
 
-    report_type = filters.get("type", "").lower()
+    report_type = (filters.get("type") or "").lower()
     filters["type"] = type_map.get(report_type, report_type)
 
     return filters
@@ -224,40 +278,489 @@ def extract_filters_via_llm(user_message: str) -> dict:
 #     return where_sql, params, table
 
 
+def is_date_column(column: str, sample: list) -> bool:
+    """
+    Checks if a report column holds dates (by its name, or by the values in the sample)
+    """
+    name = str(column).lower()
+    if 'date' in name or 'created_at' in name or 'closed_at' in name:
+        return True
+
+    values = [value for value in sample if value is not None]
+    return bool(values) and all(isinstance(value, (date, datetime)) for value in values)
+
+
+def write_excel_report(batches, columns: list[str], report_type: str, path: str) -> int:
+    """
+    Writes the report rows into an xlsx file at path, batch by batch, with xlsxwriter's constant_memory mode.
+    Column widths are estimated from the first REPORT_WIDTH_SAMPLE_ROWS rows only.
+    Rows are tuples (or dicts) in the order of columns. Returns the number of rows written.
+    """
+    batches = iter(batches)
+
+    # Buffer just enough rows to size the columns
+    sample = []
+    for rows in batches:
+        sample.extend(rows)
+        if len(sample) >= REPORT_WIDTH_SAMPLE_ROWS:
+            break
+
+    def as_tuple(row):
+        return tuple(row[column] for column in columns) if isinstance(row, dict) else row
+
+    sample = [as_tuple(row) for row in sample]
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'remove_timezone': True})
+    worksheet = workbook.add_worksheet((report_type or "report").capitalize()[:31])
+
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+
+    # Format for date columns
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+
+    cell_formats = []
+    for idx, column in enumerate(columns):
+        column_sample = [row[idx] for row in sample[:REPORT_WIDTH_SAMPLE_ROWS]]
+        col_width = max([len(str(column))] + [len(str(value)) for value in column_sample if value is not None]) + 2
+        col_width = min(col_width, REPORT_MAX_COLUMN_WIDTH)
+
+        cell_format = date_format if is_date_column(column, column_sample) else None
+        worksheet.set_column(idx, idx, col_width, cell_format)
+        cell_formats.append(cell_format)
+
+    # constant_memory needs the rows written strictly in order
+    worksheet.write_row(0, 0, columns, header_format)
+
+    row_idx = 0
+
+    def write(rows):
+        nonlocal row_idx
+        for row in rows:
+            row_idx += 1
+            for idx, value in enumerate(as_tuple(row)):
+                if value is None:
+                    continue
+                if isinstance(value, Decimal):
+                    value = float(value)
+                worksheet.write(row_idx, idx, value, cell_formats[idx])
+
+    write(sample)
+    for rows in batches:
+        write(rows)
+
+    workbook.close()
+    return row_idx
+
+
+def file_chunks(path: str, chunk_size: int = 64 * 1024, remove: bool = True):
+    """
+    Reads a file in chunks for a StreamingResponse, deleting it afterwards
+    """
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
+
+
+def excel_response(path: str, report_type: str) -> StreamingResponse:
+    """
+    Serves a written xlsx report in chunks (the file is removed once sent)
+    """
+    return StreamingResponse(
+        file_chunks(path),
+        media_type=REPORT_MEDIA_TYPES["xlsx"],
+        headers={
+            "Content-Disposition": f"attachment; filename={report_type}_report.xlsx",
+            "Content-Length": str(os.path.getsize(path))
+        }
+    )
+
+
+def temp_path(suffix: str) -> str:
+    """
+    Creates an empty temp file and returns its path
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def spool_rows(batches, path: str, progress=None) -> int:
+    """
+    Spools row batches into a file (pickled batch by batch), so a render process can read them back
+    without a DB connection. progress(rows_spooled) is called after every batch. Returns the number of rows.
+    """
+    spooled = 0
+
+    with open(path, "wb") as f:
+        for rows in batches:
+            pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+            spooled += len(rows)
+            if progress:
+                progress(spooled)
+
+    return spooled
+
+
+def spooled_rows(path: str):
+    """
+    Reads back the batches written by spool_rows, one at a time
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def spool_query(query: str, params, path: str, progress=None) -> list[str]:
+    """
+    Runs the report query on a server-side cursor and spools its rows into path. Returns the column names.
+    Blocking, the connection is released as soon as the rows are spooled.
+    """
+    with QueryStream(query, params) as stream:
+        spool_rows(stream.batches(), path, progress)
+        return stream.columns
+
+
+def render_excel_file(spool_path: str, columns: list[str], report_type: str, path: str) -> int:
+    """
+    Render process entry point: writes the xlsx report from a spooled rows file
+    """
+    return write_excel_report(spooled_rows(spool_path), columns, report_type, path)
+
+
 def generate_excel_report(query_result: list[dict], report_type: str) -> StreamingResponse:
     """
     Generate downloadable Excel report from query result with proper formatting
     """
-    df = pd.DataFrame(query_result)
+    columns = list(query_result[0].keys()) if query_result else []
+    path = temp_path(".xlsx")
+
+    try:
+        render_sync(write_excel_report, [query_result], columns, report_type, path)
+
+    except Exception:
+        os.remove(path)
+        raise
+
+    return excel_response(path, report_type)
+
+
+async def stream_excel_report_async(query: str, params, report_type: str) -> StreamingResponse:
+    """
+    Generate downloadable Excel report straight from the DB cursor: rows are spooled batch by batch
+    from a server-side cursor in the DB thread pool, rendered in constant memory in the render pool,
+    then served in chunks.
+    """
+    spool_path = temp_path(".rows")
+    path = temp_path(".xlsx")
+
+    try:
+        columns = await run_db(spool_query, query, params, spool_path)
+        await render_async(render_excel_file, spool_path, columns, report_type, path)
+
+    except Exception:
+        os.remove(path)
+        raise
+
+    finally:
+        os.remove(spool_path)
+
+    return excel_response(path, report_type)
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        sheet_name = report_type.capitalize()
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
 
-        workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
+REPORT_FORMATS = ["xlsx", "csv", "ndjson", "parquet"]
 
-        # Format for date columns
-        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+REPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
 
-        for idx, column in enumerate(df.columns):
-            col_width = max(len(str(column)), df[column].astype(str).map(len).max()) + 2
-            worksheet.set_column(idx, idx, col_width)
 
-            if 'date' in column.lower() or 'created_at' in column.lower() or 'closed_at' in column.lower():
-                worksheet.set_column(idx, idx, col_width, date_format)
+# Format names as whole words, "jsonify" or "csvkit" in a message doesn't pick a format
+REPORT_FORMAT_PATTERNS = [
+    ("parquet", re.compile(r"\bparquet\b")),
+    ("ndjson", re.compile(r"\b(nd)?json\b")),
+    ("csv", re.compile(r"\bcsv\b"))
+]
+
+
+def detect_report_format(user_message: str) -> str:
+    """
+    Picks the report format named in the message, Excel (for human users) when none is
+    """
+    text = user_message.lower()
+
+    for report_format, pattern in REPORT_FORMAT_PATTERNS:
+        if pattern.search(text):
+            return report_format
+
+    return "xlsx"
+
+
+def json_value(value):
+    """
+    Text for DB values JSON/CSV can't hold as they are (dates as ISO, decimals as strings to keep precision,
+    BLOBs as UTF-8 text, or base64 when they aren't text)
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return bytes(value).decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode("ascii")
+    return str(value)
+
+
+def csv_lines(columns: list[str], rows: list, header: bool = False) -> str:
+    """
+    Renders rows (and optionally the header) as CSV text
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(columns)
+
+    for row in rows:
+        # csv writes None as an empty field already, dates go out as ISO, BLOBs as text
+        writer.writerow([json_value(value) if isinstance(value, (date, datetime, bytes, bytearray)) else value for value in row])
+
+    return buffer.getvalue()
+
+
+def ndjson_lines(columns: list[str], rows: list) -> str:
+    """
+    Renders rows as newline-delimited JSON objects
+    """
+    return "".join(json.dumps(dict(zip(columns, row)), default=json_value) + "\n" for row in rows)
+
+
+async def stream_text_report(query: str, params, report_type: str, report_format: str) -> StreamingResponse:
+    """
+    CSV / NDJSON report streamed row by row straight from the server-side cursor,
+    the first rows go out while the rest of the result is still being read.
+    """
+    # Opened here (not in the body) so a bad query fails the request instead of a half-sent file
+    stream = await open_stream_async(query, params)
+    render = ndjson_lines if report_format == "ndjson" else csv_lines
+
+    async def body():
+        try:
+            if report_format == "csv":
+                yield csv_lines(stream.columns, [], header=True)
+
+            async for rows in stream_batches_async(stream):
+                yield render(stream.columns, rows)
+
+        finally:
+            # Also when the client is gone before the first batch (closing twice is harmless)
+            await run_db_cleanup(stream.close)
 
-    output.seek(0)
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        body(),
+        media_type=REPORT_MEDIA_TYPES[report_format],
         headers={
-            "Content-Disposition": f"attachment; filename={report_type}_report.xlsx"
+            "Content-Disposition": f"attachment; filename={report_type}_report.{report_format}"
         }
     )
 
 
+def parquet_schema(description: list):
+    """
+    Arrow schema of a report from the cursor description, fixed before any row is read,
+    so every row group has the same types whatever values it happens to hold.
+    Binary columns (BLOB, VARBINARY...) are written as binary, types without a lossless Arrow match
+    (TIME, JSON, BIT, ENUM, text...) as strings.
+    DECIMAL takes precision and scale from the description when the driver reports them (mysql-connector
+    doesn't), otherwise decimal128(38, REPORT_PARQUET_DECIMAL_SCALE), see parquet_array.
+    """
+    import pyarrow as pa
+
+    types = {
+        FieldType.TINY: pa.int64(),
+        FieldType.SHORT: pa.int64(),
+        FieldType.INT24: pa.int64(),
+        FieldType.LONG: pa.int64(),
+        FieldType.LONGLONG: pa.int64(),
+        FieldType.YEAR: pa.int64(),
+        FieldType.FLOAT: pa.float64(),
+        FieldType.DOUBLE: pa.float64(),
+        FieldType.DATE: pa.date32(),
+        FieldType.NEWDATE: pa.date32(),
+        FieldType.DATETIME: pa.timestamp("us"),
+        FieldType.TIMESTAMP: pa.timestamp("us")
+    }
+
+    binary_types = {
+        FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB, FieldType.BLOB,
+        FieldType.STRING, FieldType.VAR_STRING, FieldType.VARCHAR
+    }
+
+    fields = []
+    for col in description:
+        if col[1] in (FieldType.DECIMAL, FieldType.NEWDECIMAL):
+            precision, scale = (col[4], col[5]) if len(col) > 5 and col[5] is not None else (38, REPORT_PARQUET_DECIMAL_SCALE)
+            field_type = pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+
+        # Charset 63 is MySQL's "binary", the same type codes are used for text columns
+        elif col[1] in binary_types and len(col) > 8 and col[8] == 63:
+            field_type = pa.binary()
+
+        else:
+            field_type = types.get(col[1], pa.string())
+
+        fields.append(pa.field(col[0], field_type))
+
+    return pa.schema(fields)
+
+
+def parquet_array(values: list, field_type):
+    """
+    One column of a row group in the column's Arrow type
+    """
+    import pyarrow as pa
+
+    if pa.types.is_string(field_type):
+        values = [json_value(value) if value is not None else None for value in values]
+
+    elif pa.types.is_binary(field_type):
+        values = [value if value is None or isinstance(value, bytes) else str(value).encode("utf-8") for value in values]
+
+    elif pa.types.is_decimal(field_type):
+        # With the fallback scale, values with more fractional digits are rounded instead of failing the export
+        step = Decimal(1).scaleb(-field_type.scale)
+        values = [value.quantize(step, rounding=ROUND_HALF_EVEN) if isinstance(value, Decimal) and value.as_tuple().exponent < -field_type.scale else value for value in values]
+
+    return pa.array(values, type=field_type)
+
+
+def write_parquet_report(batches, description: list, path: str) -> int:
+    """
+    Writes the report rows into a Parquet file, one row group per batch, with the schema of parquet_schema.
+    Returns the number of rows written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet reports need the 'pyarrow' package installed")
+
+    schema = parquet_schema(description)
+    written = 0
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            table = pa.table({
+                field.name: parquet_array([row[idx] for row in rows], field.type)
+                for idx, field in enumerate(schema)
+            }, schema=schema)
+
+            writer.write_table(table)
+            written += len(rows)
+
+    # No rows at all still gives a valid file with the columns
+    return written
+
+
+def stream_parquet_report(query: str, params, report_type: str) -> StreamingResponse:
+    """
+    Parquet report written in columnar row groups straight from the server-side cursor, served in chunks.
+    Blocking, run it in the DB thread pool from async code.
+    """
+    path = temp_path(".parquet")
+
+    try:
+        with QueryStream(query, params, batch_size=REPORT_PARQUET_ROW_GROUP) as stream:
+            write_parquet_report(stream.batches(), stream.description, path)
+
+    except Exception:
+        os.remove(path)
+        raise
+
+    return StreamingResponse(
+        file_chunks(path),
+        media_type=REPORT_MEDIA_TYPES["parquet"],
+        headers={
+            "Content-Disposition": f"attachment; filename={report_type}_report.parquet",
+            "Content-Length": str(os.path.getsize(path))
+        }
+    )
+
+
+async def stream_report(query: str, params, report_type: str, report_format: str = "xlsx") -> StreamingResponse:
+    """
+    Generates the report in the selected format (xlsx, csv, ndjson or parquet)
+    """
+    if report_format in ("csv", "ndjson"):
+        return await stream_text_report(query, params, report_type, report_format)
+
+    if report_format == "parquet":
+        return await run_db(stream_parquet_report, query, params, report_type)
+
+    return await stream_excel_report_async(query, params, report_type)
+
+
+def write_text_report(batches, columns: list[str], path: str, report_format: str) -> int:
+    """
+    Writes the report rows into a CSV / NDJSON file, batch by batch. Returns the number of rows written.
+    """
+    written = 0
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if report_format == "csv":
+            f.write(csv_lines(columns, [], header=True))
+
+        for rows in batches:
+            f.write(ndjson_lines(columns, rows) if report_format == "ndjson" else csv_lines(columns, rows))
+            written += len(rows)
+
+    return written
+
+
+def write_report(query: str, params, report_type: str, report_format: str, path: str, progress=None) -> int:
+    """
+    Runs the report query on a server-side cursor and writes it to path in the given format
+    (xlsx is rendered in the render pool from spooled rows).
+    progress(rows_written) is called after every batch. Returns the number of rows written.
+    Blocking, meant for background workers.
+    """
+    if report_format == "xlsx":
+        spool_path = temp_path(".rows")
+
+        try:
+            columns = spool_query(query, params, spool_path, progress)
+            return render_sync(render_excel_file, spool_path, columns, report_type, path)
+
+        finally:
+            os.remove(spool_path)
+
+    batch_size = REPORT_PARQUET_ROW_GROUP if report_format == "parquet" else None
+
+    with QueryStream(query, params, batch_size=batch_size) as stream:
+
+        def batches():
+            written = 0
+            for rows in stream.batches():
+                yield rows
+                written += len(rows)
+                if progress:
+                    progress(written)
+
+        if report_format == "parquet":
+            return write_parquet_report(batches(), stream.description, path)
+
+        return write_text_report(batches(), stream.columns, path, report_format)
+
+
 # inp = "generate me a report of buyers where status is won from 1st april 2025 to 30 april 2025 ,boat type is narrow boat,  stern type is semi traditional, budget is £75k-£100k and layout is reverse"
 # fil = extract_filters_via_llm(inp)
 # from prompts import build_where_clause_query
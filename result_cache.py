@@ -0,0 +1,207 @@
+# Query result cache with table-level invalidation
+# Same SELECT from another user a few seconds later is served from memory.
+# Entries remember the state of the tables they read (MAX(updated_at) and MAX(id)),
+# which is polled cheaply and drops the entries as soon as one of those tables changes.
+
+import os
+import re
+import sys
+import time
+import threading
+from cachetools import LRUCache
+from dotenv import load_dotenv
+
+from db import execute_query, fetch_rows
+
+
+load_dotenv(override=True)
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_POLL_SECONDS = float(os.getenv("RESULT_CACHE_POLL_SECONDS", "5"))
+
+# A table's state is MAX(updated_at) + MAX(id): one index dive each, as long as updated_at is indexed
+# (without that index MAX(updated_at) scans the table on every poll, add one or widen the poll interval).
+# Unlike a row count it doesn't see a hard DELETE of an older row, so entries also expire after this long.
+RESULT_CACHE_MAX_AGE = float(os.getenv("RESULT_CACHE_MAX_AGE", "300"))
+
+# Only tables we can watch for changes are cached, queries touching any other table always hit MySQL
+RESULT_CACHE_TABLES = [t.strip() for t in os.getenv("RESULT_CACHE_TABLES", "leads,deals").split(",") if t.strip()]
+
+TABLE_RE = re.compile(r"\b(?:from|join)\s+`?(\w+)`?", re.IGNORECASE)
+
+# Table references TABLE_RE doesn't follow: comma joins (FROM leads l, boat_buyers b) and schema.table
+UNPARSED_TABLES_RE = re.compile(r"\bfrom\s+`?\w+`?(?:\s+(?:as\s+)?`?\w+`?)?\s*,|\b(?:from|join)\s+`?\w+`?\s*\.", re.IGNORECASE)
+
+# Results of these depend on the clock (or chance), not only on the table contents
+NON_DETERMINISTIC_RE = re.compile(r"\b(now|curdate|curtime|current_date|current_time|current_timestamp|sysdate|utc_date|utc_timestamp|rand|uuid)\b", re.IGNORECASE)
+
+
+def entry_size(entry : dict) -> int:
+
+    """
+    Approximate bytes held by a cached result (list + rows + values)
+    """
+
+    rows = entry["result"]
+    size = 0
+
+    # (columns, rows) results of with_columns
+    if isinstance(rows, tuple):
+        columns, rows = rows
+        size += sum(sys.getsizeof(column) for column in columns)
+
+    size += sys.getsizeof(rows)
+
+    for row in rows:
+        size += sys.getsizeof(row)
+        values = row.values() if isinstance(row, dict) else row
+        size += sum(sys.getsizeof(value) for value in values)
+
+    return size
+
+
+result_cache = LRUCache(maxsize=RESULT_CACHE_MAX_BYTES, getsizeof=lambda entry: entry["size"])
+
+result_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "uncacheable": 0,
+    "invalidated": 0
+}
+
+_watermarks = {}
+_last_poll = 0.0
+_lock = threading.Lock()
+
+
+def referenced_tables(sql : str) -> set | None:
+
+    """
+    Gets the table names a query reads from (FROM / JOIN), None when it has references it can't follow
+    """
+    if UNPARSED_TABLES_RE.search(sql):
+        return None
+
+    return {table.lower() for table in TABLE_RE.findall(sql)}
+
+
+def poll_watermarks() -> dict:
+
+    """
+    Gets the current state of the watched tables, polling MySQL at most every RESULT_CACHE_POLL_SECONDS.
+    Entries of tables that changed since the last poll are evicted.
+    """
+
+    global _watermarks, _last_poll
+
+    with _lock:
+        if time.time() - _last_poll < RESULT_CACHE_POLL_SECONDS:
+            return _watermarks
+
+    # One round trip for all the watched tables
+    parts = ", ".join(
+        f"(SELECT CONCAT_WS('|', MAX(updated_at), MAX(id)) FROM `{table}`)" for table in RESULT_CACHE_TABLES
+    )
+    row = fetch_rows(f"SELECT {parts}")[0]
+    current = dict(zip(RESULT_CACHE_TABLES, row))
+
+    with _lock:
+        changed = {table for table, mark in current.items() if _watermarks.get(table) != mark}
+
+        if changed and _watermarks:
+            stale = [key for key, entry in result_cache.items() if entry["tables"] & changed]
+            for key in stale:
+                result_cache.pop(key, None)
+            result_cache_stats["invalidated"] += len(stale)
+
+        _watermarks = current
+        _last_poll = time.time()
+
+        return _watermarks
+
+
+def cached_execute_query(sql : str, params = None, dictionary : bool = False, with_columns : bool = False):
+
+    """
+    Same as db.execute_query, but serves repeated queries over the watched tables from memory
+    """
+
+    tables = referenced_tables(sql)
+
+    if not tables or not tables <= set(RESULT_CACHE_TABLES) or NON_DETERMINISTIC_RE.search(sql):
+        result_cache_stats["uncacheable"] += 1
+        return execute_query(sql, params, dictionary, with_columns)
+
+    try:
+        watermarks = poll_watermarks()
+    except Exception:
+        result_cache_stats["uncacheable"] += 1
+        return execute_query(sql, params, dictionary, with_columns)
+
+    # Named (dict) params by their items, tuple() of a dict would keep only the names
+    key = (sql, tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params or ()), dictionary, with_columns)
+    snapshot = {table: watermarks.get(table) for table in tables}
+
+    with _lock:
+        entry = result_cache.get(key)
+
+        if entry and entry["snapshot"] == snapshot and time.time() - entry["cached_at"] < RESULT_CACHE_MAX_AGE:
+            result_cache_stats["hits"] += 1
+            return copy_result(entry["result"])
+
+    result_cache_stats["misses"] += 1
+    result = execute_query(sql, params, dictionary, with_columns)
+
+    # Errors come back as a string, those are never cached
+    if isinstance(result, str):
+        return result
+
+    entry = {"result": result, "tables": tables, "snapshot": snapshot, "cached_at": time.time()}
+    entry["size"] = entry_size(entry)
+
+    # Results bigger than the whole cache are simply not kept
+    if entry["size"] <= RESULT_CACHE_MAX_BYTES:
+        with _lock:
+            result_cache[key] = entry
+
+    return copy_result(result)
+
+
+def copy_result(result):
+
+    """
+    Shallow copy of a cached result, so callers can't change the cached rows list
+    """
+
+    if isinstance(result, tuple):
+        columns, rows = result
+        return list(columns), list(rows)
+
+    return list(result)
+
+
+def clear_result_cache():
+
+    """
+    Drops every cached result
+    """
+
+    with _lock:
+        result_cache.clear()
+
+
+def get_result_cache_stats() -> dict:
+
+    """
+    Gets hit rate, entries and bytes held by the result cache
+    """
+
+    lookups = result_cache_stats["hits"] + result_cache_stats["misses"]
+
+    return {
+        **result_cache_stats,
+        "entries": len(result_cache),
+        "bytes": result_cache.currsize,
+        "max_bytes": RESULT_CACHE_MAX_BYTES,
+        "hit_rate": round(result_cache_stats["hits"] / lookups, 3) if lookups else 0.0
+    }
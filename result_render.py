@@ -0,0 +1,148 @@
+# Renders query results for llm_prompt
+# Small results go in as a compact header + rows table. Big ones become a sample of rows plus
+# per-column aggregates (counts, min/max, sums, top values), so a SELECT * over leads can't blow up the prompt.
+# The total row count is always given to the model.
+
+import os
+import numbers
+from datetime import date, datetime
+from decimal import Decimal
+import pandas as pd
+from dotenv import load_dotenv
+
+from utils import estimate_tokens
+
+
+load_dotenv(override=True)
+
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "50"))
+RESULT_MAX_TOKENS = int(os.getenv("RESULT_MAX_TOKENS", "2000"))
+RESULT_SAMPLE_ROWS = int(os.getenv("RESULT_SAMPLE_ROWS", "15"))
+RESULT_MAX_CELL_CHARS = int(os.getenv("RESULT_MAX_CELL_CHARS", "80"))
+
+
+def format_value(value) -> str:
+
+    """
+    Compact text for one cell
+    """
+
+    if value is None:
+        return "NULL"
+
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M") if (value.hour or value.minute) else value.strftime("%Y-%m-%d")
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    if isinstance(value, Decimal):
+        return format(value, "f")
+
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8", errors="replace")
+
+    text = " ".join(str(value).split()).replace("|", "/")
+
+    if len(text) > RESULT_MAX_CELL_CHARS:
+        text = text[:RESULT_MAX_CELL_CHARS - 1] + "…"
+
+    return text
+
+
+def render_table(columns : list[str], rows : list) -> str:
+
+    """
+    Header line + one line per row, values separated by ' | '
+    """
+
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(format_value(value) for value in row) for row in rows)
+
+    return "\n".join(lines)
+
+
+def column_aggregates(columns : list[str], rows : list) -> str:
+
+    """
+    Per-column aggregates over all the rows, computed column-wise with pandas
+    """
+
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    lines = []
+
+    # By position, joins (SELECT * over leads and deals) can have several columns with the same name
+    for idx, column in enumerate(columns):
+        series = df.iloc[:, idx]
+        non_null = int(series.notna().sum())
+        parts = [f"non-null {non_null}"]
+
+        if not non_null:
+            lines.append(f"- {column}: " + ", ".join(parts))
+            continue
+
+        values = series.dropna()
+        is_date = pd.api.types.is_datetime64_any_dtype(series) or values.map(lambda value: isinstance(value, (date, datetime))).all()
+
+        # Only real numbers: a text column of digits (telephone_1) isn't summed
+        is_number = not is_date and values.map(lambda value: isinstance(value, numbers.Number) and not isinstance(value, bool)).all()
+
+        if is_date:
+            parts.append(f"min {format_value(pd.Timestamp(values.min()).to_pydatetime())}")
+            parts.append(f"max {format_value(pd.Timestamp(values.max()).to_pydatetime())}")
+
+        elif is_number:
+            numeric = pd.to_numeric(values)
+            parts.append(f"min {format_value(numeric.min())}")
+            parts.append(f"max {format_value(numeric.max())}")
+            parts.append(f"sum {format_value(round(float(numeric.sum()), 2))}")
+            parts.append(f"avg {format_value(round(float(numeric.mean()), 2))}")
+
+        else:
+            counts = values.astype(str).value_counts()
+            parts.append(f"distinct {len(counts)}")
+            top = ", ".join(f"{format_value(value)} ({count})" for value, count in counts.head(3).items())
+            parts.append(f"top {top}")
+
+        lines.append(f"- {column}: " + ", ".join(parts))
+
+    return "\n".join(lines)
+
+
+def render_result(result) -> str:
+
+    """
+    Renders a (columns, rows) query result for the prompt, within RESULT_MAX_ROWS / RESULT_MAX_TOKENS.
+    Error strings from execute_query are passed through as they are.
+    """
+
+    if isinstance(result, str):
+        return result
+
+    columns, rows = result
+    total = len(rows)
+
+    if total == 0:
+        return "Total rows: 0 (no matching records)"
+
+    if total <= RESULT_MAX_ROWS:
+        text = render_table(columns, rows)
+
+        if estimate_tokens(text) <= RESULT_MAX_TOKENS:
+            return f"Total rows: {total}\n{text}"
+
+    aggregates = column_aggregates(columns, rows)
+
+    # As many sample rows as fit next to the aggregates
+    sample = min(RESULT_SAMPLE_ROWS, total)
+    while True:
+        text = (
+            f"Total rows: {total} (too many to list, showing the first {sample} and aggregates over all {total})\n"
+            f"{render_table(columns, rows[:sample])}\n\n"
+            f"Column aggregates over all {total} rows:\n{aggregates}"
+        )
+
+        if estimate_tokens(text) <= RESULT_MAX_TOKENS or sample <= 1:
+            return text
+
+        sample //= 2
@@ -0,0 +1,154 @@
+# Schema catalog, keeps the database schema in process for the prompts
+
+import os
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+from db import use_connection
+
+
+load_dotenv(override=True)
+
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+
+# After a failed reload the old catalog is served this long before the next try
+SCHEMA_RETRY_SECONDS = float(os.getenv("SCHEMA_RETRY_SECONDS", "30"))
+
+_catalog = None
+_lock = threading.Lock()
+
+
+# catalog = {
+#   "tables": {"leads": [{"name": "id", "type": "int", "nullable": False, "key": "PRI"}, ...]},
+#   "foreign_keys": [("boat_buyers", "lead_id", "leads", "id"), ...],
+#   "version": "3f2a9c1b0d4e",
+#   "prompt": "leads(id,type,...)\ndeals(...)\n",
+#   "loaded_at": 1718000000.0
+# }
+
+
+def load_catalog() -> dict:
+
+    """
+    Loads all tables and columns of the current database in a single information_schema query
+    (plus one for the foreign keys)
+    """
+
+    with use_connection() as conn:
+
+        cursor = conn.cursor()
+
+        try:
+
+            cursor.execute(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """
+            )
+
+            tables = {}
+            for table, column, column_type, nullable, key in cursor.fetchall():
+                tables.setdefault(table, []).append({
+                    "name": column,
+                    "type": column_type,
+                    "nullable": nullable == "YES",
+                    "key": key or ""
+                })
+
+            cursor.execute(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+                FROM information_schema.KEY_COLUMN_USAGE
+                WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+                """
+            )
+            foreign_keys = [tuple(row) for row in cursor.fetchall()]
+
+        finally:
+            cursor.close()
+
+    prompt = render_schema(tables)
+
+    return {
+        "tables": tables,
+        "foreign_keys": foreign_keys,
+        "version": hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12],
+        "prompt": prompt,
+        "loaded_at": time.time()
+    }
+
+
+def render_schema(tables: dict) -> str:
+
+    """
+    Renders the tables into the compact `table(col1,col2,...)` format used in prompts
+    """
+
+    return "".join(
+        f"{table}({','.join(col['name'] for col in columns)})\n"
+        for table, columns in tables.items()
+    )
+
+
+def get_catalog() -> dict:
+
+    """
+    Returns the cached catalog, reloading it once the TTL has expired.
+    If a reload fails and an older catalog exists, the older one keeps being served.
+    """
+
+    global _catalog
+
+    catalog = _catalog
+    if catalog and time.time() - catalog["loaded_at"] < SCHEMA_CACHE_TTL:
+        return catalog
+
+    with _lock:
+
+        # Another request may have reloaded it while we were waiting
+        if _catalog and time.time() - _catalog["loaded_at"] < SCHEMA_CACHE_TTL:
+            return _catalog
+
+        try:
+            _catalog = load_catalog()
+
+        except Exception:
+            if _catalog is None:
+                raise
+
+            # Backs off: the next reload is tried SCHEMA_RETRY_SECONDS from now, not by every caller meanwhile
+            _catalog = {**_catalog, "loaded_at": time.time() - SCHEMA_CACHE_TTL + SCHEMA_RETRY_SECONDS}
+
+        return _catalog
+
+
+def get_schema_prompt() -> str:
+
+    """
+    Gets the pre-rendered schema string for the prompts
+    """
+    return get_catalog()["prompt"]
+
+
+def get_schema_version() -> str:
+
+    """
+    Gets the version (content hash) of the current schema
+    """
+    return get_catalog()["version"]
+
+
+def invalidate_schema():
+
+    """
+    Drops the cached catalog, the next call loads it fresh from the database
+    """
+
+    global _catalog
+
+    with _lock:
+        _catalog = None
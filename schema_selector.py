@@ -0,0 +1,217 @@
+# Relevance-based schema pruning for sql_prompt
+# Instead of dumping every table into the prompt, only the tables (and columns) a question is likely
+# to need are rendered: a lexical index over table/column names, business synonyms (vendor -> seller,
+# sales -> deals, ...) and one hop over foreign keys, so the tables needed for the joins come along.
+
+import os
+import re
+from dotenv import load_dotenv
+
+from schema_catalog import get_catalog, render_schema
+
+
+load_dotenv(override=True)
+
+SCHEMA_PRUNING = os.getenv("SCHEMA_PRUNING", "true").lower() == "true"
+
+# Business words -> words used in the database names
+SYNONYMS = {
+    "vendor": ["seller"],
+    "vendors": ["seller"],
+    "sale": ["deal"],
+    "sales": ["deal"],
+    "sold": ["deal", "sale"],
+    "bought": ["deal", "buyer"],
+    "purchase": ["deal", "buyer"],
+    "customer": ["buyer", "lead"],
+    "customers": ["buyer", "lead"],
+    "client": ["lead"],
+    "clients": ["lead"],
+    "enquiry": ["lead"],
+    "enquiries": ["lead"],
+    "commission": ["deal", "commission"],
+    "contract": ["deal"],
+    "price": ["price", "valuation"],
+    "phone": ["telephone"],
+    "mobile": ["telephone"],
+    "name": ["name"],
+    "email": ["email"],
+    "emails": ["email"],
+    "listing": ["listed", "seller"],
+    "listings": ["listed", "seller"],
+    "boats": ["boat"],
+    "narrowboat": ["boat"],
+    "brochures": ["brochure"],
+}
+
+# Too common in the names to tell tables apart
+STOP_WORDS = {"id", "at", "the", "a", "of", "in", "for", "to", "and", "or", "is", "are", "me", "show", "list", "how", "many", "all", "what", "which", "who"}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_index = {"version": None}
+
+
+def stem(word : str) -> str:
+
+    """
+    Very small stemmer, enough to match 'deals' to 'deal' and 'buyers' to 'buyer'
+    """
+
+    if len(word) > 3 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def name_tokens(name : str) -> set:
+
+    """
+    Splits a snake_case table/column name into stemmed tokens
+    """
+    return {stem(token) for token in TOKEN_RE.findall(name.lower()) if token not in STOP_WORDS}
+
+
+def question_tokens(user_input : str) -> set:
+
+    """
+    Stemmed question tokens, expanded with the synonyms
+    """
+
+    tokens = set()
+    for word in TOKEN_RE.findall(user_input.lower()):
+        if word in STOP_WORDS:
+            continue
+        tokens.add(stem(word))
+        tokens.update(stem(synonym) for synonym in SYNONYMS.get(word, []))
+
+    return tokens
+
+
+def build_index(catalog : dict) -> dict:
+
+    """
+    Builds the token -> tables/columns index and the foreign-key graph of a catalog
+    """
+
+    table_tokens = {}
+    column_tokens = {}
+    links = {table: set() for table in catalog["tables"]}
+
+    for table, columns in catalog["tables"].items():
+        table_tokens[table] = name_tokens(table)
+        column_tokens[table] = {col["name"]: name_tokens(col["name"]) for col in columns}
+
+    foreign_keys = list(catalog.get("foreign_keys", []))
+
+    # Columns like lead_id without a declared constraint still point at leads
+    for table, columns in catalog["tables"].items():
+        for col in columns:
+            if col["name"].endswith("_id"):
+                target = col["name"][:-3]
+                for candidate in (target, target + "s"):
+                    if candidate in catalog["tables"] and candidate != table:
+                        foreign_keys.append((table, col["name"], candidate, "id"))
+
+    for table, column, ref_table, ref_column in foreign_keys:
+        if table in links and ref_table in links:
+            links[table].add(ref_table)
+            links[ref_table].add(table)
+
+    return {
+        "version": catalog["version"],
+        "table_tokens": table_tokens,
+        "column_tokens": column_tokens,
+        "links": links,
+        "foreign_keys": foreign_keys
+    }
+
+
+def get_index(catalog : dict) -> dict:
+
+    """
+    Gets the index of the current catalog, rebuilt once per schema version
+    """
+
+    global _index
+
+    if _index["version"] != catalog["version"]:
+        _index = build_index(catalog)
+
+    return _index
+
+
+def select_tables(user_input : str, catalog : dict) -> dict:
+
+    """
+    Picks the relevant tables and columns. Returns {table: [column names]} or {} if nothing matched.
+    Directly matched tables keep all their columns, join-only neighbours just their keys and matched columns.
+    """
+
+    index = get_index(catalog)
+    tokens = question_tokens(user_input)
+
+    scores = {}
+    matched_columns = {}
+
+    for table in catalog["tables"]:
+        score = 3 * len(tokens & index["table_tokens"][table])
+        matched = [name for name, col_tokens in index["column_tokens"][table].items() if tokens & col_tokens]
+        score += len(matched)
+
+        if score:
+            scores[table] = score
+            matched_columns[table] = matched
+
+    if not scores:
+        return {}
+
+    # Drop weak matches (a single shared column word) when something matched much better
+    best = max(scores.values())
+    direct = {table for table, score in scores.items() if score >= max(2, best / 4)} or {max(scores, key=scores.get)}
+
+    selected = {}
+    for table in direct:
+        selected[table] = [col["name"] for col in catalog["tables"][table]]
+
+    fk_columns = {}
+    for table, column, ref_table, ref_column in index["foreign_keys"]:
+        fk_columns.setdefault(table, set()).add(column)
+
+    # One hop over the foreign keys, for the joins
+    for table in direct:
+        for neighbour in index["links"][table]:
+            if neighbour in selected:
+                continue
+
+            selected[neighbour] = [
+                col["name"] for col in catalog["tables"][neighbour]
+                if col["key"] == "PRI" or col["name"] in fk_columns.get(neighbour, ()) or col["name"] in matched_columns.get(neighbour, ())
+            ]
+
+    return selected
+
+
+def relevant_schema(user_input : str) -> str:
+
+    """
+    Renders only the relevant part of the schema for sql_prompt (the whole schema if nothing matched)
+    """
+
+    catalog = get_catalog()
+
+    if not SCHEMA_PRUNING:
+        return catalog["prompt"]
+
+    selected = select_tables(user_input, catalog)
+    if not selected:
+        return catalog["prompt"]
+
+    # Keep the catalog's table and column order
+    tables = {
+        table: [col for col in columns if col["name"] in selected[table]]
+        for table, columns in catalog["tables"].items() if table in selected
+    }
+
+    return render_schema(tables)
@@ -0,0 +1,128 @@
+# NL-to-SQL cache for the query intent
+# Brokers ask the same questions all day, so validated SQL is reused instead of regenerated.
+# Keyed on the normalized question, the resolved date window and the schema version.
+
+import os
+import re
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+
+load_dotenv(override=True)
+
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "512"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "3600"))
+
+# TTLCache evicts the least recently used entry once full, and every entry after its TTL
+sql_cache = TTLCache(maxsize=SQL_CACHE_SIZE, ttl=SQL_CACHE_TTL)
+
+sql_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "bypassed": 0,
+    "stored": 0
+}
+
+# Words that point back into the conversation ("show their emails", "same for last year").
+# A question with any of these depends on the history, so its SQL can't be shared.
+FOLLOW_UP_WORDS = {
+    "it", "its", "they", "them", "their", "those", "these", "that", "this one", "he", "she", "his", "her",
+    "same", "above", "previous", "again", "also", "else", "instead", "what about", "how about"
+}
+
+FILLER_WORDS = {"please", "pls", "kindly", "me", "can", "you", "could", "would", "the"}
+
+
+def normalize_question(user_input : str) -> str:
+
+    """
+    Normalizes the question so trivially different phrasings share a key
+    """
+
+    words = re.findall(r"[a-z0-9£]+", user_input.lower())
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def history_is_relevant(user_input : str, history : list[str]) -> bool:
+
+    """
+    Checks if the question needs the conversation history to be understood
+    """
+
+    if not history:
+        return False
+
+    text = " " + " ".join(re.findall(r"[a-z0-9£]+", user_input.lower())) + " "
+    return any(f" {word} " in text for word in FOLLOW_UP_WORDS)
+
+
+def cache_key(user_input : str, time_context : dict, schema_version : str) -> tuple:
+
+    """
+    Builds the cache key: normalized question, resolved date window and schema version
+    """
+
+    return (
+        normalize_question(user_input),
+        time_context.get("start_date") if time_context else None,
+        time_context.get("end_date") if time_context else None,
+        schema_version
+    )
+
+
+def get_cached_sql(key : tuple):
+
+    """
+    Gets the previously validated SQL for this key (None on a miss)
+    """
+
+    sql = sql_cache.get(key)
+
+    if sql is None:
+        sql_cache_stats["misses"] += 1
+    else:
+        sql_cache_stats["hits"] += 1
+
+    return sql
+
+
+def store_sql(key : tuple, sql : str):
+
+    """
+    Stores SQL that was generated, passed the safety check and executed fine
+    """
+
+    sql_cache[key] = sql
+    sql_cache_stats["stored"] += 1
+
+
+def record_bypass():
+
+    """
+    Counts a request that skipped the cache (asked for it, or depends on history)
+    """
+    sql_cache_stats["bypassed"] += 1
+
+
+def clear_sql_cache():
+
+    """
+    Drops every cached SQL
+    """
+    sql_cache.clear()
+
+
+def get_sql_cache_stats() -> dict:
+
+    """
+    Gets hit/miss counters and the current size of the cache
+    """
+
+    lookups = sql_cache_stats["hits"] + sql_cache_stats["misses"]
+
+    return {
+        **sql_cache_stats,
+        "size": len(sql_cache),
+        "max_size": SQL_CACHE_SIZE,
+        "hit_rate": round(sql_cache_stats["hits"] / lookups, 3) if lookups else 0.0
+    }
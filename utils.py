@@ -1,8 +1,18 @@
 # Utils functions
 import re
 import json
+import math
 from datetime import datetime, timedelta
 
+def estimate_tokens(text: str) -> int:
+
+    """
+    Rough token count of a prompt text (~4 characters per token), good enough for budgeting
+    """
+
+    return math.ceil(len(text) / 4)
+
+
 def cleaned_sql(sql: str) -> str:
 
     """